@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Benchmarks of the protocol, parsing and storage hot paths.
+
+Results are printed as one JSON document, so runs on different versions
+or machines can be stored and compared, e.g.
+
+    python bench/benchmark.py --output results-$(git describe).json
+"""
+import argparse
+import datetime
+import gzip
+import http.server
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from inverter_simulator import InverterSimulator, VirtualInverter  # noqa: E402
+from serial_communicator import SerCom  # noqa: E402
+import voltronic_protocol  # noqa: E402
+
+
+def timed(func, repeat, number=None):
+    """Per call timings of func, the best run is the least disturbed one."""
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    runs = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    return {
+        'calls': number * repeat,
+        'best_us': round(min(runs) * 1e6, 3),
+        'median_us': round(statistics.median(runs) * 1e6, 3),
+        'ops_per_s': round(1 / min(runs)),
+    }
+
+
+class LoopbackSerial(object):
+    """In-memory serial port answering with canned frames of a virtual inverter."""
+
+    is_open = True
+    timeout = SerCom.FRAME_TIMEOUT
+
+    def __init__(self):
+        """Render one response frame per query."""
+        inverter = VirtualInverter('loopback', seed=1)
+        self._frames = {}
+        for cmd in ('QPIGS', 'QPIWS', 'QMOD', 'QPIRI', 'QFLAG'):
+            request = cmd.encode('ascii') + SerCom._get_crc(cmd.encode('ascii')) + SerCom.CR
+            self._frames[request] = inverter.received(request)[0]
+        self._rx = b''
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def write(self, data):
+        self._rx = self._frames[bytes(data)]
+
+    def read(self, size=1):
+        data, self._rx = self._rx[:size], self._rx[size:]
+        return data
+
+    def reset_input_buffer(self):
+        self._rx = b''
+
+    def close(self):
+        pass
+
+
+class LoopbackSerCom(SerCom):
+    """SerCom on a LoopbackSerial, the full send/receive path without I/O."""
+
+    def __init__(self, port=None):
+        super().__init__('/nonexistent/loopback')
+        self._ser = LoopbackSerial()
+
+
+class LoopbackVoltronic(voltronic_protocol.Voltronic):
+    transport = LoopbackSerCom
+
+
+def bench_crc(repeat):
+    """CRC and frame encode/decode throughput."""
+    loopback = LoopbackSerial()
+    status_frame = loopback._frames[b'QPIGS' + SerCom._get_crc(b'QPIGS') + SerCom.CR]
+    status_payload = status_frame[:-3]
+    sercom = LoopbackSerCom()
+    sercom._ser = loopback
+
+    def encode():
+        sercom.send_cmd('QPIGS')
+
+    def decode():
+        sercom.status = 'SENDING'
+        sercom._check_frame(bytearray(status_frame[:-1]))
+
+    return {
+        'crc_command': timed(lambda: SerCom._get_crc(b'QPIGS'), repeat),
+        'crc_qpigs_frame': dict(timed(lambda: SerCom._get_crc(status_payload), repeat),
+                                bytes=len(status_payload)),
+        'frame_encode': timed(encode, repeat),
+        'frame_decode_qpigs': timed(decode, repeat),
+    }
+
+
+def bench_parse(repeat):
+    """Response parsing and full query path per call, without serial I/O."""
+    proto = LoopbackVoltronic()
+    status = proto._ser._ser._frames[b'QPIGS' + SerCom._get_crc(b'QPIGS') + SerCom.CR]
+    warning = proto._ser._ser._frames[b'QPIWS' + SerCom._get_crc(b'QPIWS') + SerCom.CR]
+    status, warning = status[1:-3].decode(), warning[1:-3].decode()
+    return {
+        'parse_qpigs': timed(lambda: proto._on_operational_status(status), repeat),
+        'parse_qpiws': timed(lambda: proto._on_warning_status(warning), repeat),
+        'get_operational_status': timed(proto.get_operational_status, repeat),
+        'get_warning_status': timed(proto.get_warning_status, repeat),
+    }
+
+
+class InfluxStub(http.server.BaseHTTPRequestHandler):
+    """Minimal InfluxDB 1.x HTTP API, counting the written points."""
+
+    points = 0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if not self.path.startswith('/write'):
+            # e.g. CREATE DATABASE or retention policy queries
+            self.do_GET()
+            return
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        with InfluxStub.lock:
+            InfluxStub.points += body.count(b'\n') + (not body.endswith(b'\n'))
+            InfluxStub.requests += 1
+        self.send_response(204)
+        self.end_headers()
+
+    def do_GET(self):
+        payload = b'{"results":[{"statement_id":0}]}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_influx(points):
+    """InfluxDBHandler enqueue cost and write throughput to a local HTTP server."""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), InfluxStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ.update({
+        'DB_HOST': '127.0.0.1', 'DB_PORT': str(server.server_address[1]),
+        'DB_SPOOL_PATH': '', 'DB_BUFFER_SIZE': str(points * 2),
+    })
+    from influxdbhandler import InfluxDBHandler
+
+    proto = LoopbackVoltronic()
+    proto.get_operational_status()
+    data = dict(proto.status)
+    results = {}
+    for gzip_enabled in (True, False):
+        InfluxDBHandler.DB_GZIP = gzip_enabled
+        InfluxStub.points = InfluxStub.requests = 0
+        db = InfluxDBHandler()
+        start = time.perf_counter()
+        for number in range(points):
+            data['battery_voltage'] = 50 + number * 0.001
+            db.write_measurements(data, 'operational_status', {'inverter': 'bench'})
+        enqueued = time.perf_counter()
+        db.close()
+        deadline = time.monotonic() + 60
+        while InfluxStub.points < points and time.monotonic() < deadline:
+            time.sleep(0.001)
+        written = time.perf_counter()
+        results['gzip' if gzip_enabled else 'plain'] = {
+            'points': points,
+            'received_points': InfluxStub.points,
+            'requests': InfluxStub.requests,
+            'enqueue_us_per_point': round((enqueued - start) / points * 1e6, 3),
+            'points_per_s': round(InfluxStub.points / (written - start)),
+        }
+    server.shutdown()
+    return results
+
+
+def bench_end_to_end(cycles):
+    """Poll cycle time (QPIWS, QMOD, QPIGS) against the inverter simulator."""
+    results = {}
+    for name, baudrate, latency in (('line_2400_baud', 2400, 0.05),
+                                    ('unpaced', 0, 0.0)):
+        simulator = InverterSimulator(baudrate)
+        port = simulator.add(VirtualInverter('bench', latency, seed=1))
+        simulator.start()
+        proto = voltronic_protocol.Voltronic(port)
+        durations = []
+        for _ in range(cycles):
+            start = time.perf_counter()
+            proto.get_warning_status()
+            proto.get_device_mode()
+            proto.get_operational_status()
+            durations.append(time.perf_counter() - start)
+        proto.close()
+        simulator.stop()
+        results[name] = {
+            'cycles': cycles,
+            'baudrate': baudrate,
+            'latency_s': latency,
+            'min_ms': round(min(durations) * 1e3, 3),
+            'median_ms': round(statistics.median(durations) * 1e3, 3),
+            'max_ms': round(max(durations) * 1e3, 3),
+        }
+    return results
+
+
+def environment():
+    try:
+        version = subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=SRC,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        version = None
+    return {
+        'version': version,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+BENCHMARKS = ('crc', 'parse', 'influx', 'end_to_end')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--only', default=','.join(BENCHMARKS),
+                        help='comma separated subset of ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--quick', action='store_true', help='fewer repetitions')
+    parser.add_argument('--output', help='write results to a file instead of stdout')
+    args = parser.parse_args()
+
+    selected = args.only.split(',')
+    repeat = 3 if args.quick else 7
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # spools and frame logs of the benchmarks go to the scratch directory
+        os.chdir(workdir)
+        try:
+            if 'crc' in selected:
+                results['crc'] = bench_crc(repeat)
+            if 'parse' in selected:
+                results['parse'] = bench_parse(repeat)
+            if 'influx' in selected:
+                results['influx'] = bench_influx(5000 if args.quick else 50000)
+            if 'end_to_end' in selected:
+                results['end_to_end'] = bench_end_to_end(5 if args.quick else 20)
+        finally:
+            os.chdir(cwd)
+    report = json.dumps({'environment': environment(), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
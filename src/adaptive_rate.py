@@ -0,0 +1,85 @@
+"""Adaptive poll rate module."""
+import logging
+import math
+import os
+
+
+class AdaptiveRate(object):
+    """Poll period following the activity of the device.
+
+    A watched field moving at least its threshold between two samples, or
+    any change of an observed value (device mode, warning bits), drops the
+    period to the floor at once. After QUIET_SAMPLES calm samples in a row
+    the period doubles, up to the ceiling. The floor is raised as needed to
+    keep the serial link busy at most LINK_BUDGET of the time.
+    """
+
+    ENABLED = os.getenv('ADAPTIVE_POLL', 'no').lower() in ['true', '1', 'y', 'yes']
+    PERIOD_MIN = float(os.getenv('ADAPTIVE_PERIOD_MIN', 1))
+    PERIOD_MAX = float(os.getenv('ADAPTIVE_PERIOD_MAX', 30))
+    THRESHOLDS = os.getenv('ADAPTIVE_THRESHOLDS',
+                           'ac_output_active_power=100,battery_voltage=0.2')
+    QUIET_SAMPLES = int(os.getenv('ADAPTIVE_QUIET_SAMPLES', 3))
+    LINK_BUDGET = float(os.getenv('LINK_BUDGET', 0.5))
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, period, thresholds=None):
+        """Initialize at period, thresholds map field names to changes."""
+        if thresholds is None:
+            thresholds = self._parse_thresholds(self.THRESHOLDS)
+        self.thresholds = dict(thresholds)
+        self.period = min(max(period, self.PERIOD_MIN), self.PERIOD_MAX)
+        self._last = dict()
+        self._active = False
+        self._quiet = 0
+
+    @staticmethod
+    def _parse_thresholds(spec):
+        thresholds = dict()
+        for item in spec.split(','):
+            if item.strip():
+                field, threshold = item.split('=')
+                thresholds[field.strip()] = float(threshold)
+        return thresholds
+
+    def observe(self, name, value):
+        """Note a value, any change of it counts as activity."""
+        if name in self._last and self._last[name] != value:
+            self._active = True
+        self._last[name] = value
+
+    def floor(self, cost, other_load) -> float:
+        """Shortest period within the link budget.
+
+        cost is the duration of one poll, other_load the share of link time
+        taken by the other polls.
+        """
+        room = max(self.LINK_BUDGET - other_load, 0.01)
+        # whole tenths keep the ticks on round wall clock boundaries
+        floor = math.ceil(cost / room * 10) / 10
+        return min(max(self.PERIOD_MIN, floor), self.PERIOD_MAX)
+
+    def update(self, sample, cost=0.0, other_load=0.0) -> float:
+        """Period until the next poll after a sample."""
+        for field, threshold in self.thresholds.items():
+            last = self._last.get(field)
+            if last is not None and abs(sample[field] - last) >= threshold:
+                self._active = True
+            self._last[field] = sample[field]
+        floor = self.floor(cost, other_load)
+        period = self.period
+        if self._active:
+            period = floor
+            self._quiet = 0
+        else:
+            self._quiet += 1
+            if self._quiet >= self.QUIET_SAMPLES:
+                period = min(period * 2, self.PERIOD_MAX)
+                self._quiet = 0
+        self._active = False
+        period = max(period, floor)
+        if period != self.period:
+            self.log.debug("Poll period %s s -> %s s.", self.period, period)
+            self.period = period
+        return period
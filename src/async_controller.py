@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Solar inverter controller, asyncio variant.
+
+Polls every inverter and serves a JSON status endpoint from one event
+loop, serial responses are awaited instead of blocking a thread each.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+import sink_pipeline
+import voltronic_protocol
+from async_voltronic import AsyncInverterConfig, AsyncVoltronic
+from fixed_rate_scheduler import FixedRateScheduler
+from frame_recorder import FrameRecorder
+from inverter_worker import InverterWorker
+
+STATUS_PORT = int(os.getenv('STATUS_PORT', 0))     # 0: no status endpoint
+
+
+class AsyncInverterWorker(object):
+    """Polling and configuration tasks of one inverter."""
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, name, port, config, db):
+        """Initialize inverter handlers, from the running event loop."""
+        self.name = name
+        self.tags = {'inverter': name}
+        self.proto = AsyncVoltronic(port)
+        self.icfg = AsyncInverterConfig(self.proto, config)
+        self.db = db
+        self.recorder = FrameRecorder(name) if FrameRecorder.ENABLED else None
+        if self.recorder is not None:
+            self.proto.record_frames(self.recorder)
+        self.overruns = {'info': 0, 'setup': 0}
+
+    def write_measurements(self, data, measurement, **tags):
+        """Write measurement tagged with the inverter name."""
+        self.db.write_measurements(data, measurement, dict(self.tags, **tags))
+
+    def _count_overrun(self, loop, started, period):
+        if time.time() - started > period:
+            self.overruns[loop] += 1
+
+    @staticmethod
+    async def _sleep_until_tick(period):
+        """Sleep until the next wall clock aligned period boundary."""
+        now = time.time()
+        await asyncio.sleep(FixedRateScheduler.next_tick(period, now) - now)
+
+    async def info_loop(self):
+        proto = self.proto
+        while True:
+            self.log.debug('[%s] ---> INFO loop started --->', self.name)
+            started = time.time()
+            try:
+                await proto.get_warning_status()
+                self.write_measurements(proto.warning, 'warning_status')
+                await proto.get_device_mode()
+                self.write_measurements({'mode': proto.device_mode.name}, 'device_mode')
+                await proto.get_operational_status()
+                self.write_measurements(proto.status, 'operational_status')
+            except voltronic_protocol.VoltronicError as err:
+                self.log.warning('[%s] INFO loop failed: %s', self.name, err)
+                self.write_measurements({'reachable': False}, 'link_status')
+            except Exception:
+                self.log.exception('[%s] INFO loop failed.', self.name)
+            else:
+                self.write_measurements({'reachable': True}, 'link_status')
+            self.log.debug('[%s] <--- INFO loop finished.', self.name)
+            self._count_overrun('info', started, InverterWorker.POLL_QPIGS)
+            await self._sleep_until_tick(InverterWorker.POLL_QPIGS)
+
+    async def setup_loop(self):
+        while True:
+            self.log.debug('[%s] ---> SETUP loop started --->', self.name)
+            started = time.time()
+            try:
+                await self.icfg._check_inverter_configuration()
+            except voltronic_protocol.VoltronicError as err:
+                self.log.warning('[%s] SETUP loop failed: %s', self.name, err)
+            except Exception:
+                self.log.exception('[%s] SETUP loop failed.', self.name)
+            self.log.debug('[%s] <--- SETUP loop finished.', self.name)
+            self._count_overrun('setup', started, InverterWorker.SETUP_INTERVAL)
+            await self._sleep_until_tick(InverterWorker.SETUP_INTERVAL)
+
+    async def watch_config(self):
+        """Run a setup pass at once when the configuration file changed."""
+        while True:
+            await self._sleep_until_tick(InverterWorker.CONFIG_CHECK_INTERVAL)
+            try:
+                if self.icfg._reload_config():
+                    await self.icfg._check_inverter_configuration()
+            except voltronic_protocol.VoltronicError as err:
+                self.log.warning('[%s] SETUP loop failed: %s', self.name, err)
+            except Exception:
+                self.log.exception('[%s] SETUP loop failed.', self.name)
+
+    async def stats_loop(self):
+        """Write loop overruns and serial command statistics periodically."""
+        while True:
+            await self._sleep_until_tick(InverterWorker.STATS_INTERVAL)
+            try:
+                for loop, overruns in self.overruns.items():
+                    self.write_measurements({'overruns': overruns}, 'scheduler', task=loop)
+                for command, fields in self.proto.instrumentation.export():
+                    self.write_measurements(fields, 'command_stats', command=command)
+            except Exception:
+                self.log.exception('[%s] Statistics report failed.', self.name)
+
+    def status(self):
+        """Latest known values, JSON serializable."""
+        proto = self.proto
+        return {
+            'device_mode': proto.device_mode.name if proto.device_mode else None,
+            'status': proto.status,
+            'warning': proto.warning,
+            'fault': proto.fault,
+        }
+
+
+async def serve_status(workers):
+    """Serve the latest values of all inverters as JSON over HTTP."""
+    async def handle(reader, writer):
+        await reader.readline()
+        body = json.dumps({worker.name: worker.status() for worker in workers}).encode()
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n'
+                     b'Content-Length: %d\r\n\r\n' % len(body) + body)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, port=STATUS_PORT)
+    log.info('Serving status on port %d.', STATUS_PORT)
+    async with server:
+        await server.serve_forever()
+
+
+async def main():
+    db = sink_pipeline.SinkPipeline.from_env()
+    workers = [
+        AsyncInverterWorker(
+            inverter['name'],
+            inverter.get('port'),
+            inverter.get('config'),
+            db)
+        for inverter in InverterWorker.load_inverters()
+    ]
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    tasks = []
+    for worker in workers:
+        log.info('Starting inverter [%s].', worker.name)
+        tasks.append(asyncio.create_task(worker.setup_loop()))
+        tasks.append(asyncio.create_task(worker.info_loop()))
+        tasks.append(asyncio.create_task(worker.watch_config()))
+        tasks.append(asyncio.create_task(worker.stats_loop()))
+    if STATUS_PORT:
+        tasks.append(asyncio.create_task(serve_status(workers)))
+
+    await stop.wait()
+    log.info('Signal received, exiting.')
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for worker in workers:
+        worker.proto.close()
+        if worker.recorder is not None:
+            worker.recorder.close()
+    db.close()
+
+### main program
+# logger startup
+log = logging.getLogger()
+log.setLevel(logging.getLevelName(os.getenv('LOG_LEVEL', 'INFO').upper()))
+log_formatter = logging.Formatter('%(asctime)s %(levelname)8s (%(name)s) %(message)s')
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(log_formatter)
+log.addHandler(log_handler)
+log.info('STARTING Solar Inverter Controller (asyncio)...')
+
+asyncio.run(main())
@@ -0,0 +1,95 @@
+"""Asyncio serial communication handler module."""
+import asyncio
+import time
+
+import serial
+
+from serial_communicator import SerCom
+
+
+class AsyncSerCom(SerCom):
+    """Serial communication on the asyncio event loop.
+
+    The port is read in non-blocking mode by an event loop reader callback,
+    responses are awaited instead of blocking the thread. Must be created
+    from a running event loop.
+    """
+
+    def __init__(self, port=None):
+        """Initialize and open serial line."""
+        self._loop = asyncio.get_running_loop()
+        self._frame_waiter = None
+        self._reader_fd = None
+        super().__init__(port)
+
+    def open(self) -> bool:
+        """Open serial line and register the event loop reader."""
+        if self._ser.is_open:
+            return True
+        if not super().open():
+            return False
+        self._ser.timeout = 0
+        self._reader_fd = self._ser.fileno()
+        self._loop.add_reader(self._reader_fd, self._on_readable)
+        return True
+
+    def _remove_reader(self):
+        if self._reader_fd is not None:
+            self._loop.remove_reader(self._reader_fd)
+            self._reader_fd = None
+
+    def close(self):
+        """Close serial line."""
+        self._remove_reader()
+        super().close()
+
+    def _io_failure(self):
+        self._remove_reader()
+        super()._io_failure()
+        self._wake_reader()
+
+    def _wake_reader(self):
+        if self._frame_waiter is not None and not self._frame_waiter.done():
+            self._frame_waiter.set_result(None)
+
+    def _on_readable(self):
+        try:
+            data = self._ser.read(self._ser.in_waiting or 1)
+        except serial.SerialException:
+            self._io_failure()
+            return
+        if data and self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+        self._rx_buffer.extend(data)
+        if SerCom.CR in data:
+            self._wake_reader()
+
+    async def _read_frame_async(self):
+        """Await bytes up to the next CR within one frame deadline."""
+        deadline = self._loop.time() + SerCom.FRAME_TIMEOUT
+        while True:
+            frame_end = self._rx_buffer.find(SerCom.CR)
+            if frame_end >= 0:
+                frame = self._rx_buffer[:frame_end]
+                del self._rx_buffer[:frame_end + 1]
+                return frame
+            remaining = deadline - self._loop.time()
+            if remaining <= 0 or not self._ser.is_open:
+                return None
+            self._frame_waiter = self._loop.create_future()
+            try:
+                await asyncio.wait_for(self._frame_waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._frame_waiter = None
+
+    async def read_resp_async(self) -> str:
+        """Await serial response with CRC check."""
+        if self.status != "SENDING":
+            return False
+        self.status = "RECEIVING"
+        raw_response = await self._read_frame_async()
+        if self.status == "ERROR":
+            return False
+        return self._check_frame(raw_response)
@@ -0,0 +1,87 @@
+"""Asyncio Voltronic protocol handler module."""
+import asyncio
+import time
+
+from async_serial_communicator import AsyncSerCom
+from inverter_configurator import InverterConfig
+from serial_gateway import GatewayClient
+from voltronic_protocol import CommandRejectedError, Voltronic
+
+
+class AsyncVoltronic(Voltronic):
+    """Voltronic protocol handler with awaitable get_*/set_* methods.
+
+    Must be created from a running event loop.
+    """
+
+    transport = AsyncSerCom
+
+    def __init__(self, port=None):
+        """Constructor, the port must be a serial device, not a gateway."""
+        if port and port.startswith(GatewayClient.URL_PREFIX):
+            raise ValueError('{}: the asyncio variant can not use a serial gateway'
+                             .format(port))
+        super().__init__(port)
+        # concurrent tasks must not interleave commands on the port
+        self._port_lock = asyncio.Lock()
+
+    async def _query(self, cmd, handler=None):
+        if self._cache_hit(cmd):
+            return None
+        started = time.perf_counter()
+        response = self._handle(cmd, handler, await self._send_cmd(cmd), started)
+        self._cache_store(cmd)
+        return response
+
+    async def _send_cmd(self, cmd):
+        ser = self._ser
+        response = None
+        for attempt, delay in enumerate(self._retry.delays(self._max_attempts(cmd))):
+            if attempt:
+                self._log_retry(cmd, response)
+                await asyncio.sleep(delay)
+            if not ser.open():
+                response = None
+                self._record_attempt(cmd, attempt, response, None)
+                continue
+            async with self._port_lock:
+                Voltronic.log.debug('-> %s ...', cmd)
+                started = time.perf_counter()
+                ser.send_cmd(cmd)
+                response = await ser.read_resp_async()
+                self._record_attempt(cmd, attempt, response, started)
+            if response and response != 'NAK':
+                return self._succeeded(cmd, response)
+        self._failed(cmd, response)
+
+
+class AsyncInverterConfig(InverterConfig):
+    """Inverter configuration driving an AsyncVoltronic."""
+
+    async def _apply_change(self, change) -> bool:
+        try:
+            await change.setter(change.value)
+        except CommandRejectedError as err:
+            self.log.warning("Inverter rejected configuration [{}]: {}."
+                             .format(change.name, err))
+            return False
+        return True
+
+    async def _check_inverter_configuration(self):
+        self._reload_config()
+        if not self.icfg:
+            return  # no valid configuration loaded yet
+
+        await self.proto.get_device_rating()
+        await self.proto.get_options()
+
+        changes = self._plan_changes()
+        if not changes:
+            return
+        for change in changes:
+            await self._apply_change(change)
+
+        # setters invalidated the cached state, read back once
+        await self.proto.get_device_rating()
+        await self.proto.get_options()
+        self._verify(changes)
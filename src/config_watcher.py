@@ -0,0 +1,94 @@
+"""Configuration file watcher module."""
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import os
+
+
+class ConfigWatcher(object):
+    """Cheap change detection of a configuration file.
+
+    On Linux an inotify watch on the parent directory tells when anything
+    there changed, so an idle check costs a single non-blocking read. Where
+    inotify is unavailable every check stats the file. Either way a
+    content hash confirms a change before it is reported, so touching or
+    rewriting a file with the same content does not count.
+    """
+
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, path):
+        """Start watching path."""
+        self.path = path
+        self._stat = None
+        self._digest = None
+        self._inotify_fd = self._inotify_watch(os.path.dirname(os.path.abspath(path)))
+
+    def _inotify_watch(self, directory):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            fd = -1
+        if fd < 0:
+            self.log.info("inotify unavailable, polling [%s].", self.path)
+            return None
+        mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM
+                | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE)
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            self.log.info("Can not watch [%s], polling [%s].", directory, self.path)
+            return None
+        return fd
+
+    def _inotify_events(self) -> bool:
+        """Drain pending inotify events, True if there were any."""
+        events = False
+        while True:
+            try:
+                events = bool(os.read(self._inotify_fd, 4096)) or events
+            except BlockingIOError:
+                return events
+
+    def changed(self) -> bool:
+        """True if the file content changed since the last call.
+
+        The first call always reports a change.
+        """
+        if self._digest is not None and self._inotify_fd is not None:
+            if not self._inotify_events():
+                return False
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature == self._stat:
+            return False
+        try:
+            with open(self.path, 'rb') as config_file:
+                digest = hashlib.sha1(config_file.read()).digest()
+        except OSError as err:
+            # e.g. not readable yet, checked again with the next change
+            self.log.debug("Can not read [%s]: %s", self.path, err)
+            return False
+        self._stat = signature
+        if digest == self._digest:
+            return False
+        self._digest = digest
+        return True
+
+    def close(self):
+        """Stop watching."""
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
@@ -0,0 +1,69 @@
+"""Emission filter module."""
+import logging
+import os
+import time
+
+
+class EmissionFilter(object):
+    """Filter dropping measurement fields which carry no new information.
+
+    Change-only measurements are emitted as a whole when any field changed.
+    Fields with a deadband are emitted when they moved more than the band
+    since their last emitted value, other fields are always emitted. Every
+    series is emitted in full at least once per heartbeat interval.
+    """
+
+    CHANGE_ONLY = os.getenv('EMIT_CHANGE_ONLY', 'warning_status,device_mode,link_status')
+    DEADBANDS = os.getenv('EMIT_DEADBANDS', '')      # e.g. battery_voltage=0.05,pv_input_voltage=1
+    HEARTBEAT = float(os.getenv('EMIT_HEARTBEAT', 300))
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, change_only=None, deadbands=None, heartbeat=None):
+        """Initialize filter, unset parameters come from the environment."""
+        if change_only is None:
+            change_only = [name.strip() for name in self.CHANGE_ONLY.split(',')
+                           if name.strip()]
+        if deadbands is None:
+            deadbands = self._parse_deadbands(self.DEADBANDS)
+        self.change_only = frozenset(change_only)
+        self.deadbands = dict(deadbands)
+        self.heartbeat = self.HEARTBEAT if heartbeat is None else heartbeat
+        self._last_values = dict()
+        self._last_full = dict()
+
+    @staticmethod
+    def _parse_deadbands(spec):
+        deadbands = dict()
+        for item in spec.split(','):
+            if item.strip():
+                field, band = item.split('=')
+                deadbands[field.strip()] = float(band)
+        return deadbands
+
+    def filter(self, measurement, data, series=None) -> dict:
+        """Return a copy of the fields of data to emit, empty if none.
+
+        The optional series key separates the state of equally named
+        measurements, e.g. of different inverters.
+        """
+        key = (measurement, series)
+        now = time.monotonic()
+        last = self._last_values.get(key)
+        if last is None or now - self._last_full[key] >= self.heartbeat:
+            self._last_values[key] = dict(data)
+            self._last_full[key] = now
+            return dict(data)
+        if measurement in self.change_only:
+            if data == last:
+                return dict()
+            self._last_values[key] = dict(data)
+            return dict(data)
+        emitted = dict()
+        for field, value in data.items():
+            band = self.deadbands.get(field)
+            if band is not None and field in last and abs(value - last[field]) <= band:
+                continue
+            emitted[field] = value
+            last[field] = value
+        return emitted
@@ -0,0 +1,89 @@
+"""Energy counter module."""
+import json
+import logging
+import os
+import time
+
+
+class EnergyCounter(object):
+    """Energy counters in kWh, integrated from power samples.
+
+    Power is integrated with the trapezoidal rule between consecutive
+    samples. Intervals longer than MAX_GAP, e.g. while the inverter was
+    unreachable or the controller was stopped, are not bridged. Lifetime
+    counters only grow, daily counters restart at local midnight. Both
+    are saved to a JSON state file and survive restarts.
+    """
+
+    STATE_DIR = os.getenv('ENERGY_STATE_DIR', 'var/solar')
+    MAX_GAP = float(os.getenv('ENERGY_MAX_GAP', 60))
+    SAVE_INTERVAL = float(os.getenv('ENERGY_SAVE_INTERVAL', 60))
+
+    # counter name -> power [W] of a QPIGS sample
+    SOURCES = {
+        'consumption': lambda status: status['ac_output_active_power'],
+        'solar': lambda status: status['pv_input_voltage'] * status['pv_input_current'],
+        'charge': lambda status: status['battery_voltage'] * status['battery_charging_current'],
+        'discharge': lambda status: status['battery_voltage'] * status['battery_discharge_current'],
+    }
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, name):
+        """Initialize the counters of an inverter from its state file."""
+        self.path = os.path.join(self.STATE_DIR, 'energy-{}.json'.format(name))
+        self.lifetime = dict.fromkeys(self.SOURCES, 0.0)
+        self.daily = dict.fromkeys(self.SOURCES, 0.0)
+        self.day = None
+        self._last_time = None
+        self._last_power = None
+        self._next_save = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as err:
+            self.log.warning("Energy state %s unreadable, counting from zero: %s",
+                             self.path, err)
+            return
+        self.lifetime.update(state['lifetime'])
+        self.daily.update(state['daily'])
+        self.day = state['day']
+        self.log.info("Energy counters loaded from %s.", self.path)
+
+    def save(self):
+        """Write the counters to the state file, atomically."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as state_file:
+            json.dump({'lifetime': self.lifetime, 'daily': self.daily, 'day': self.day},
+                      state_file)
+        os.replace(temporary, self.path)
+
+    def add(self, timestamp, status) -> dict:
+        """Integrate a sample, returns the counters as fields."""
+        power = {name: max(source(status), 0) for name, source in self.SOURCES.items()}
+        day = time.strftime('%Y-%m-%d', time.localtime(timestamp))
+        if day != self.day:
+            self.daily = dict.fromkeys(self.SOURCES, 0.0)
+            self.day = day
+        if self._last_time is not None and 0 < timestamp - self._last_time <= self.MAX_GAP:
+            hours = (timestamp - self._last_time) / 3600
+            for name in self.SOURCES:
+                energy = (self._last_power[name] + power[name]) / 2 * hours / 1000
+                self.lifetime[name] += energy
+                self.daily[name] += energy
+        self._last_time = timestamp
+        self._last_power = power
+        if time.monotonic() >= self._next_save:
+            self.save()
+            self._next_save = time.monotonic() + self.SAVE_INTERVAL
+        fields = dict()
+        for name in self.SOURCES:
+            fields[name + '_kwh'] = self.lifetime[name]
+            fields[name + '_kwh_today'] = self.daily[name]
+        return fields
@@ -0,0 +1,128 @@
+"""Fixed-rate scheduler module."""
+import logging
+import math
+import sched
+import time
+
+
+class PeriodicTask(object):
+    """Periodic task with its timing statistics."""
+
+    def __init__(self, name, period, func, priority):
+        """Initialize task."""
+        self.name = name
+        self.period = period
+        self.func = func
+        self.priority = priority
+        self.runs = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.event = None       # queued run, None while running
+
+    def stats(self) -> dict:
+        """Timing statistics, max duration is reset on read."""
+        stats = {
+            'period': float(self.period),
+            'runs': self.runs,
+            'overruns': self.overruns,
+            'skipped_ticks': self.skipped_ticks,
+            'last_duration': self.last_duration,
+            'max_duration': self.max_duration,
+        }
+        self.max_duration = 0.0
+        return stats
+
+
+class FixedRateScheduler(object):
+    """Run periodic tasks at fixed rates, aligned to wall clock boundaries.
+
+    A task with a 5 s period runs at :00, :05, :10... regardless of how
+    long the previous run took. Runs overrunning their next tick are
+    counted, the missed ticks are skipped instead of piling up.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, delayfunc=time.sleep):
+        """Initialize empty scheduler."""
+        self._scheduler = sched.scheduler(time.time, delayfunc)
+        self._cancelled = False
+        self.tasks = dict()
+
+    @staticmethod
+    def next_tick(period, now) -> float:
+        """First period boundary after now."""
+        return (math.floor(now / period) + 1) * period
+
+    def add(self, name, period, func, priority=1):
+        """Add a task running func every period seconds."""
+        task = PeriodicTask(name, period, func, priority)
+        self.tasks[name] = task
+        self._enter(task, self.next_tick(period, time.time()))
+        return task
+
+    def _enter(self, task, tick):
+        if self._cancelled:
+            return
+        task.event = self._scheduler.enterabs(
+            tick, task.priority, self._run_task, (task, tick))
+
+    def _run_task(self, task, tick):
+        task.event = None
+        period = task.period
+        started = time.time()
+        try:
+            task.func()
+        finally:
+            finished = time.time()
+            task.runs += 1
+            task.last_duration = finished - started
+            task.max_duration = max(task.max_duration, task.last_duration)
+            if task.period != period:
+                self._enter(task, self.next_tick(task.period, finished))
+            else:
+                self._enter(task, self._following_tick(task, tick, finished))
+
+    def set_period(self, name, period):
+        """Change the period of a task.
+
+        A queued run is brought forward to the next boundary of a shorter
+        period, otherwise the new period applies from the next run.
+        """
+        task = self.tasks[name]
+        if period == task.period:
+            return
+        task.period = period
+        if task.event is not None:
+            tick = self.next_tick(period, time.time())
+            if tick < task.event.time:
+                self._scheduler.cancel(task.event)
+                self._enter(task, tick)
+
+    def _following_tick(self, task, tick, now):
+        next_tick = tick + task.period
+        if next_tick <= now:
+            skipped = math.floor((now - next_tick) / task.period) + 1
+            task.overruns += 1
+            task.skipped_ticks += skipped
+            self.log.debug('Task [%s] overran its period of %s s, %d ticks skipped.',
+                           task.name, task.period, skipped)
+            return next_tick + skipped * task.period
+        if next_tick - now > task.period:
+            # wall clock stepped backwards
+            return self.next_tick(task.period, now)
+        return next_tick
+
+    def run(self):
+        """Run tasks until the queue is empty."""
+        self._scheduler.run()
+
+    def cancel_all(self):
+        """Remove all queued task runs, run() returns."""
+        self._cancelled = True
+        for event in self._scheduler.queue:
+            self._scheduler.cancel(event)
+        for task in self.tasks.values():
+            task.event = None
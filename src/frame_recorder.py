@@ -0,0 +1,80 @@
+"""Raw frame recorder module.
+
+Every command is appended to a binary log as sent and received, so the
+history can be parsed again, see frame_replay.py. A log file starts with
+MAGIC, followed by records of little endian fields: time (f8, unix s),
+request length (u1), response length (u2), the request without CRC and
+the response frame with its '(' and CRC but without CR. Timed out
+commands have an empty response. Records are not aligned, the file is
+read by memory mapping it.
+"""
+import glob
+import logging
+import os
+import struct
+import time
+
+
+MAGIC = b'PI30LOG1'
+RECORD_HEADER = struct.Struct('<dBH')
+
+
+class FrameRecorder(object):
+    """Append request/response frames to rotating log files of one inverter."""
+
+    ENABLED = os.getenv('FRAME_LOG', 'no').lower() in ['true', '1', 'y', 'yes']
+    DIRECTORY = os.getenv('FRAME_LOG_DIR', 'var/solar/frames')
+    MAX_BYTES = int(os.getenv('FRAME_LOG_MAX_BYTES', 64 * 1024 * 1024))
+    KEEP = int(os.getenv('FRAME_LOG_KEEP', 0))     # files kept, 0: all
+    FLUSH_INTERVAL = float(os.getenv('FRAME_LOG_FLUSH_INTERVAL', 5))
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, name, directory=None):
+        """Initialize, the first file is created with the first record."""
+        self.name = name
+        self.directory = directory or self.DIRECTORY
+        self._file = None
+        self._size = 0
+        self._next_flush = 0
+
+    @staticmethod
+    def files(directory, name) -> list:
+        """Log files of an inverter, oldest first."""
+        return sorted(glob.glob(os.path.join(directory, '{}-frames-*.bin'.format(name))))
+
+    def _rotate(self):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '{}-frames-{}.bin'.format(
+            self.name, time.strftime('%Y%m%d-%H%M%S')))
+        # a restart within the same second appends to the same file
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._size = self._file.tell()
+        self.log.debug('[%s] Recording frames to %s.', self.name, path)
+        if self.KEEP:
+            for old in self.files(self.directory, self.name)[:-self.KEEP]:
+                os.unlink(old)
+
+    def record(self, request, response, timestamp=None):
+        """Append one command, request and response as bytes-like objects."""
+        if self._file is None or self._size >= self.MAX_BYTES:
+            self._rotate()
+        now = time.time()
+        header = RECORD_HEADER.pack(
+            now if timestamp is None else timestamp, len(request), len(response))
+        self._file.write(header)
+        self._file.write(request)
+        self._file.write(response)
+        self._size += len(header) + len(request) + len(response)
+        if now >= self._next_flush:
+            self._file.flush()
+            self._next_flush = now + self.FLUSH_INTERVAL
+
+    def close(self):
+        """Flush and close the current file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""Frame log replay module.
+
+Parses recorded frames again and writes them to InfluxDB in large
+batches, e.g. to re-derive the history after a parser fix. QPIGS
+responses are decoded column-wise with NumPy, all responses of one
+layout at once, odd frames fall back to the Voltronic parser. The 1m and
+1h rollup tiers are computed in the same pass, as the continuous queries
+only roll up recent points.
+
+    python frame_replay.py var/solar/frames/inverter-frames-*.bin
+"""
+import argparse
+import binascii
+import itertools
+import logging
+import mmap
+import os
+import re
+import time
+
+import numpy
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
+
+from frame_recorder import MAGIC, RECORD_HEADER
+from emission_filter import EmissionFilter
+from influxdbhandler import InfluxDBHandler
+from response_parser import BitField
+from retention_tiers import RetentionTiers
+from serial_communicator import SerCom
+from sink_pipeline import series_key
+from voltronic_protocol import Voltronic
+
+
+def sort_block(times, columns):
+    """Rows of a column block in time order, kept as is if already sorted."""
+    if len(times) < 2 or (times[1:] >= times[:-1]).all():
+        return times, columns
+    order = numpy.argsort(times, kind='stable')
+    return times[order], {name: values[order] for name, values in columns.items()}
+
+
+class FrameLog(object):
+    """Memory mapped frame log file."""
+
+    # CRC bytes as escaped by the inverter
+    CRC_ESCAPE = numpy.frombuffer(SerCom.CRC_ESCAPE, numpy.uint8)
+
+    def __init__(self, path):
+        """Map and index the file, raises ValueError if it is not a frame log."""
+        self.path = path
+        with open(path, 'rb') as log_file:
+            self._map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError('not a frame log')
+        self.buffer = numpy.frombuffer(self._map, numpy.uint8)
+        self._index()
+
+    def _index(self):
+        """Record positions, the only pass over the records in Python.
+
+        A last record truncated by a crash is ignored.
+        """
+        data = self._map
+        unpack = RECORD_HEADER.unpack_from
+        header = RECORD_HEADER.size
+        end = len(data) - header
+        position = len(MAGIC)
+        positions = []
+        while position <= end:
+            _, request_length, response_length = unpack(data, position)
+            if position + header + request_length + response_length > len(data):
+                break
+            positions.append(position)
+            position += header + request_length + response_length
+        positions = numpy.array(positions, numpy.int64)
+        headers = self.buffer[positions[:, None] + numpy.arange(header)]
+        self.times = headers[:, :8].copy().view('<f8').reshape(-1)
+        self.request_lengths = headers[:, 8].astype(numpy.int64)
+        self.response_lengths = headers[:, 9:11].copy().view('<u2').reshape(-1).astype(numpy.int64)
+        self.request_offsets = positions + header
+        self.response_offsets = self.request_offsets + self.request_lengths
+
+    def __len__(self):
+        """Number of records."""
+        return len(self.times)
+
+    def rows(self, offsets, length):
+        """2D byte array of equally long slices."""
+        return self.buffer[offsets[:, None] + numpy.arange(length)]
+
+    def responses(self, command):
+        """Times, payload offsets and lengths of the valid responses to command.
+
+        Payloads are without '(' and CRC. Also returns the number of timed
+        out and corrupted responses.
+        """
+        request = numpy.frombuffer(command.encode('ascii'), numpy.uint8)
+        selected = numpy.flatnonzero(self.request_lengths == len(request))
+        selected = selected[(self.rows(self.request_offsets[selected], len(request))
+                             == request).all(axis=1)]
+        offsets = self.response_offsets[selected]
+        lengths = self.response_lengths[selected]
+        framed = (lengths > 3) & (self.buffer[numpy.minimum(offsets, len(self.buffer) - 1)] == 0x28)
+        offsets, lengths, times = offsets[framed], lengths[framed], self.times[selected[framed]]
+        valid = numpy.zeros(len(offsets), numpy.bool_)
+        with memoryview(self._map) as view:
+            for length in numpy.unique(lengths).tolist():
+                group = numpy.flatnonzero(lengths == length)
+                frames = self.rows(offsets[group], length)
+                # a run of equal frames, e.g. of an unchanged status, is checked once
+                starts = numpy.ones(len(group), numpy.bool_)
+                starts[1:] = (frames[1:] != frames[:-1]).any(axis=1)
+                crc = numpy.fromiter((binascii.crc_hqx(view[offset:offset + length - 2], 0)
+                                      for offset in offsets[group[starts]].tolist()), numpy.int64)
+                checked = ((frames[starts, -2] == self.CRC_ESCAPE[crc >> 8])
+                           & (frames[starts, -1] == self.CRC_ESCAPE[crc & 0xff]))
+                valid[group] = checked[numpy.cumsum(starts) - 1]
+        return times[valid], offsets[valid] + 1, lengths[valid] - 3, len(selected) - int(valid.sum())
+
+    def close(self):
+        """Unmap the file."""
+        self.buffer = None
+        self._map.close()
+
+
+class FixedWidthDecoder(object):
+    """Column-wise decoder of the responses of a ResponseParser schema.
+
+    The inverter pads numbers to fixed widths, so responses of the same
+    length share one layout: the field positions are taken from the most
+    common one and each field is converted for all rows with a few array
+    operations. Rows deviating from it, e.g. by a sign or a shifted
+    separator, are left to the scalar parser.
+    """
+
+    SEPARATOR = ord(' ')
+    DOT = ord('.')
+    ZERO = ord('0')
+
+    def __init__(self, parser):
+        """Initialize from a schema of float, int and BitField fields."""
+        for name, _, field_type in parser.schema:
+            if field_type not in (float, int) and not isinstance(field_type, BitField):
+                raise ValueError('{}: not a fixed width field'.format(name))
+        self.parser = parser
+        self.dtypes = dict()
+        for name, _, field_type in parser.schema:
+            if isinstance(field_type, BitField):
+                self.dtypes.update(dict.fromkeys(field_type.names, numpy.bool_))
+            else:
+                self.dtypes[name] = numpy.float64 if field_type is float else numpy.int64
+
+    @staticmethod
+    def _layout(separators, tries=3):
+        """Rows sharing the separator positions of most rows.
+
+        Layouts are tried in row order, a deviating row is rarely first.
+        """
+        best = numpy.zeros(len(separators), numpy.bool_)
+        candidates = numpy.ones(len(separators), numpy.bool_)
+        for _ in range(tries):
+            ok = (separators == separators[numpy.argmax(candidates)]).all(axis=1)
+            if ok.sum() > best.sum():
+                best = ok
+            candidates &= ~ok
+            if best.sum() * 2 >= len(separators) or not candidates.any():
+                break
+        return best
+
+    def decode(self, rows):
+        """Columns of the decodable rows of a 2D byte array, and their mask."""
+        separators = rows == self.SEPARATOR
+        ok = self._layout(separators)
+        template = rows[numpy.argmax(ok)].tobytes()
+        tokens = [match.span() for match in re.finditer(rb'[^ ]+', template)]
+        # decimal points where most rows have them, the template may be corrupted
+        decimal_points = (rows[ok] == self.DOT).sum(axis=0) * 2 > ok.sum()
+        columns = dict()
+        for name, index, field_type in self.parser.schema:
+            if index >= len(tokens):
+                ok[:] = False
+                break
+            start, end = tokens[index]
+            dots = [column for column in range(start, end) if decimal_points[column]]
+            digits = [column for column in range(start, end) if column not in dots]
+            if len(dots) > 1 or (dots and field_type is not float):
+                ok[:] = False
+                break
+            for column in dots:
+                ok &= rows[:, column] == self.DOT
+            values = rows[:, digits].astype(numpy.int64) - self.ZERO
+            if isinstance(field_type, BitField):
+                ok &= ((values == 0) | (values == 1)).all(axis=1)
+                bits = values @ (1 << numpy.arange(len(digits) - 1, -1, -1, dtype=numpy.int64))
+                for flag, mask in field_type.bits:
+                    columns[flag] = (bits & mask) != 0
+                continue
+            ok &= ((values >= 0) & (values <= 9)).all(axis=1)
+            number = values @ 10 ** numpy.arange(len(digits) - 1, -1, -1, dtype=numpy.int64)
+            if field_type is float:
+                # exact integers divided by a power of ten round like float()
+                decimals = end - dots[0] - 1 if dots else 0
+                number = number / 10 ** decimals
+            columns[name] = number
+        if not ok.any():
+            return {name: numpy.empty(0, dtype) for name, dtype in self.dtypes.items()}, ok
+        return {name: columns[name][ok] for name in self.dtypes}, ok
+
+
+class BlockRollup(object):
+    """Per period aggregates of column blocks, as the continuous queries do.
+
+    The last, possibly incomplete period of a block is held back until a
+    later block or flush().
+    """
+
+    def __init__(self, period, functions):
+        """Initialize with the aggregate function of each field, mean or last."""
+        self.period = period
+        self.functions = functions
+        self._pending = None
+
+    def add(self, times, columns):
+        """Aggregates of the periods completed by a block."""
+        if self._pending is not None:
+            pending_times, pending = self._pending
+            times = numpy.concatenate((pending_times, times))
+            columns = {name: numpy.concatenate((pending[name], values))
+                       for name, values in columns.items() if name in pending}
+        if not len(times):
+            return times, columns
+        times, columns = sort_block(times, columns)
+        split = numpy.searchsorted(times, times[-1] // self.period * self.period)
+        self._pending = times[split:], {name: values[split:] for name, values in columns.items()}
+        return self._aggregate(times[:split], {name: values[:split]
+                                               for name, values in columns.items()})
+
+    def flush(self):
+        """Aggregates of the held back period."""
+        if self._pending is None:
+            return numpy.empty(0), dict()
+        times, columns = self._pending
+        self._pending = None
+        return self._aggregate(times, columns)
+
+    def _aggregate(self, times, columns):
+        starts, index, counts = numpy.unique(
+            times // self.period * self.period, return_index=True, return_counts=True)
+        aggregates = dict()
+        if not len(starts):
+            return starts, aggregates
+        for name, values in columns.items():
+            function = self.functions.get(name)
+            if function == 'mean':
+                aggregates[name] = numpy.add.reduceat(values.astype(numpy.float64), index) / counts
+            elif function == 'last':
+                aggregates[name] = values[index + counts - 1]
+        return starts, aggregates
+
+
+class FrameReplay(object):
+    """Re-parse the frame logs of one inverter and write the points."""
+
+    BATCH_SIZE = int(os.getenv('REPLAY_BATCH_SIZE', 50000))
+    RETENTION_MARGIN = 3600     # raw points this close to expiry are skipped too
+
+    # measurement of each replayed query
+    MEASUREMENTS = {
+        'QPIGS': 'operational_status',
+        'QPIWS': 'warning_status',
+        'QMOD': 'device_mode',
+    }
+
+    # line protocol field format of each column dtype kind
+    FIELD_FORMATS = {'b': '{}', 'i': '{}i', 'u': '{}i', 'f': '{!r}', 'U': '"{}"'}
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, db, inverter, raw=True, rollups=True, raw_retention=None):
+        """Initialize, db is an InfluxDBClient, None only counts points.
+
+        Raw points older than raw_retention seconds, the duration of the
+        default policy, would be refused, only their rollups are written.
+        """
+        self.db = db
+        self.tags = {'inverter': inverter}
+        self.raw = raw
+        self.raw_since = None
+        if raw_retention is not None:
+            self.raw_since = time.time() - raw_retention + self.RETENTION_MARGIN
+        self.emission = EmissionFilter()
+        self.fixed_width = {'QPIGS': FixedWidthDecoder(Voltronic.QPIGS_PARSER)}
+        self.parsers = {
+            'QPIGS': Voltronic.QPIGS_PARSER,
+            'QPIWS': Voltronic.QPIWS_WARNING_BITS,
+            'QMOD': lambda response: {'mode': Voltronic.DEVICE_MODES[response].name},
+        }
+        self.rollups = dict()
+        if rollups:
+            aggregates = RetentionTiers.aggregates()
+            for measurement in self.MEASUREMENTS.values():
+                functions = dict(aggregates[measurement])
+                self.rollups[measurement] = (('rollup_1m', BlockRollup(60, functions)),
+                                             ('rollup_1h', BlockRollup(3600, functions)))
+        self.stats = dict.fromkeys(
+            ('records', 'invalid', 'vectorized', 'scalar', 'failed', 'expired', 'points',
+             'rejected'), 0)
+
+    def replay(self, paths):
+        """Replay log files in time order."""
+        for path in paths:
+            try:
+                frame_log = FrameLog(path)
+            except ValueError as err:
+                # e.g. empty, the recorder stopped before the first record
+                self.log.warning('Skipped %s: %s', path, err)
+                continue
+            try:
+                self._replay_log(frame_log)
+            finally:
+                frame_log.close()
+        for measurement, tiers in self.rollups.items():
+            self._flush_rollups(measurement, tiers)
+        return self.stats
+
+    def _replay_log(self, frame_log):
+        self.log.info('%s: replaying %d records.', frame_log.path, len(frame_log))
+        self.stats['records'] += len(frame_log)
+        for command, measurement in self.MEASUREMENTS.items():
+            times, offsets, lengths, invalid = frame_log.responses(command)
+            self.stats['invalid'] += invalid
+            blocks = []
+            for length in numpy.unique(lengths):
+                group = numpy.flatnonzero(lengths == length)
+                blocks.extend(self._decode(command, frame_log.rows(offsets[group], length),
+                                           times[group]))
+            blocks = [block for block in blocks if len(block[0])]
+            if not blocks:
+                continue
+            times, columns = sort_block(
+                numpy.concatenate([block_times for block_times, _ in blocks]),
+                {name: numpy.concatenate([block[name] for _, block in blocks])
+                 for name in blocks[0][1]})
+            if self.raw:
+                self._write(measurement, None, *self._unexpired(
+                    *self._emitted(measurement, times, columns)))
+            self._roll_up(measurement, self.rollups.get(measurement, ()), times, columns)
+
+    def _decode(self, command, rows, times):
+        """Decoded blocks of the responses of one length."""
+        decoder = self.fixed_width.get(command)
+        if decoder is not None:
+            columns, ok = decoder.decode(rows)
+            self.stats['vectorized'] += int(ok.sum())
+            yield times[ok], columns
+            rows, times = rows[~ok], times[~ok]
+        if len(times):
+            yield self._decode_scalar(command, rows, times)
+
+    def _decode_scalar(self, command, rows, times):
+        """Columns of responses parsed one by one.
+
+        Status responses mostly repeat the previous one, only the first
+        response of each run of equal ones is parsed.
+        """
+        parse = self.parsers[command]
+        starts = numpy.ones(len(rows), numpy.bool_)
+        starts[1:] = (rows[1:] != rows[:-1]).any(axis=1)
+        run = numpy.cumsum(starts) - 1
+        decoded = []
+        for response in rows[starts]:
+            try:
+                decoded.append(parse(response.tobytes().decode('ascii')))
+            except (UnicodeDecodeError, ValueError, IndexError, KeyError):
+                decoded.append(None)
+        parsed = numpy.array([fields is not None for fields in decoded], numpy.bool_)
+        ok = parsed[run]
+        self.stats['scalar'] += int(ok.sum())
+        self.stats['failed'] += len(ok) - int(ok.sum())
+        decoded = [fields for fields in decoded if fields is not None]
+        if not decoded:
+            return times[:0], dict()
+        # row -> index among the successfully parsed runs
+        index = (numpy.cumsum(parsed) - 1)[run[ok]]
+        decoder = self.fixed_width.get(command)
+        dtypes = decoder.dtypes if decoder is not None else dict()
+        return times[ok], {
+            name: numpy.array([fields[name] for fields in decoded], dtypes.get(name))[index]
+            for name in decoded[0]}
+
+    def _unexpired(self, times, columns):
+        """Raw points still within the retention of the default policy."""
+        if self.raw_since is None:
+            return times, columns
+        keep = times >= self.raw_since
+        self.stats['expired'] += len(keep) - int(keep.sum())
+        return times[keep], {name: values[keep] for name, values in columns.items()}
+
+    def _emitted(self, measurement, times, columns):
+        """Raw points as written live: change-only series on change or heartbeat."""
+        if measurement not in self.emission.change_only:
+            return times, columns
+        emit = numpy.ones(len(times), numpy.bool_)
+        emit[1:] = (times[1:] // self.emission.heartbeat) != (times[:-1] // self.emission.heartbeat)
+        for values in columns.values():
+            emit[1:] |= values[1:] != values[:-1]
+        return times[emit], {name: values[emit] for name, values in columns.items()}
+
+    def _roll_up(self, measurement, tiers, times, columns):
+        """Feed a block through the tiers, each rolling up the one before."""
+        for policy, rollup in tiers:
+            times, columns = rollup.add(times, columns)
+            if not len(times):
+                return
+            self._write(measurement, policy, times, columns)
+
+    def _flush_rollups(self, measurement, tiers):
+        """Write the held back periods at the end of the logs."""
+        blocks = []
+        for policy, rollup in tiers:
+            blocks = [block for block in [rollup.add(*block) for block in blocks] + [rollup.flush()]
+                      if len(block[0])]
+            for block in blocks:
+                self._write(measurement, policy, *block)
+
+    def _write(self, measurement, policy, times, columns):
+        """Write columns as line protocol points, time in s."""
+        lines = self._lines(measurement, times, columns)
+        self.stats['points'] += len(lines)
+        if self.db is None:
+            return
+        for start in range(0, len(lines), self.BATCH_SIZE):
+            batch = lines[start:start + self.BATCH_SIZE]
+            try:
+                self.db.write_points(batch, time_precision='ms', protocol='line',
+                                     retention_policy=policy)
+            except InfluxDBClientError as err:
+                # e.g. a partial write of points beyond the retention policy
+                self.log.warning('%s: %d points rejected: %s', measurement, len(batch), err)
+                self.stats['rejected'] += len(batch)
+
+    def _lines(self, measurement, times, columns):
+        """Line protocol points, each distinct field value formatted once."""
+        fields = []
+        for name, values in columns.items():
+            field = '{}={}'.format(name, self.FIELD_FORMATS[values.dtype.kind])
+            distinct, inverse = numpy.unique(values, return_inverse=True)
+            text = numpy.array([field.format(value) for value in distinct.tolist()], object)
+            fields.append(text[inverse.reshape(-1)].tolist())
+        timestamps = map(str, (times * 1000).astype(numpy.int64).tolist())
+        return list(map(' '.join, zip(itertools.repeat(series_key(measurement, self.tags)),
+                                      map(','.join, zip(*fields)), timestamps)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='+', help='frame log files, in time order per inverter')
+    parser.add_argument('--inverter', help='inverter tag, default: from the file names')
+    parser.add_argument('--no-raw', action='store_true', help='write the rollup tiers only')
+    parser.add_argument('--no-rollups', action='store_true', help='write the raw points only')
+    parser.add_argument('--dry-run', action='store_true', help='parse only, write nothing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    inverters = dict()
+    for path in args.paths:
+        match = re.match('(.*)-frames-', os.path.basename(path))
+        if not (args.inverter or match):
+            parser.error('{}: no inverter name in the file name, use --inverter'.format(path))
+        name = args.inverter or match.group(1)
+        inverters.setdefault(name, []).append(path)
+
+    db = None
+    rollups = not args.no_rollups
+    raw_retention = None
+    if not args.dry_run:
+        db = InfluxDBClient(InfluxDBHandler.DB_HOST, InfluxDBHandler.DB_PORT,
+                            InfluxDBHandler.DB_USER, InfluxDBHandler.DB_PASS,
+                            InfluxDBHandler.DB_NAME, gzip=InfluxDBHandler.DB_GZIP)
+        if InfluxDBHandler.PROVISION:
+            try:
+                RetentionTiers(db, InfluxDBHandler.DB_NAME).provision()
+            except InfluxDBClientError as err:
+                logging.warning('Retention tiers not provisioned: %s', err)
+        policies = db.get_list_retention_policies()
+        for policy in policies:
+            if policy['default']:
+                raw_retention = RetentionTiers.seconds(policy['duration'])
+        if rollups and not {'rollup_1m', 'rollup_1h'} <= {policy['name'] for policy in policies}:
+            logging.warning('No rollup tiers, set DB_PROVISION=yes to create them.')
+            rollups = False
+    for name, paths in inverters.items():
+        replay = FrameReplay(db, name, not args.no_raw, rollups, raw_retention)
+        stats = replay.replay(sorted(paths))
+        logging.info('[%s] %s', name, ', '.join('{} {}'.format(key, value)
+                                                for key, value in stats.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,26 @@
 """InfluxDB Handler module."""
+import collections
 import logging
 import os
+import threading
+import time
 
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
+
+from point_spool import PointSpool
+from retention_tiers import RetentionTiers
+from sink_pipeline import Record
 
 
 class InfluxDBHandler(object):
-    """InfluxDB Handler class."""
+    """InfluxDB Handler class.
+
+    Measurements are timestamped when sampled and buffered in memory. A
+    background thread writes them in batches, so a slow or unreachable
+    database never blocks the caller. Batches failing to write go to an
+    on-disk spool, replayed at a limited rate once the database is back.
+    """
 
     ENABLED = os.getenv('INFLUX', 'yes').lower() in ['true', '1', 'y', 'yes']
     DB_HOST = os.getenv('DB_HOST', 'localhost')
@@ -14,13 +28,31 @@ class InfluxDBHandler(object):
     DB_NAME = os.getenv('DB_NAME', 'solar')
     DB_USER = os.getenv('DB_USER', 'solar')
     DB_PASS = os.getenv('DB_PASS', 'verysecret')
+    DB_GZIP = os.getenv('DB_GZIP', 'yes').lower() in ['true', '1', 'y', 'yes']
+    BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 500))
+    FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', 10))
+    BUFFER_SIZE = int(os.getenv('DB_BUFFER_SIZE', 20000))
+    SPOOL_PATH = os.getenv('DB_SPOOL_PATH', 'var/solar/spool.sqlite')
+    SPOOL_MAX_POINTS = int(os.getenv('DB_SPOOL_MAX_POINTS', 1000000))
+    REPLAY_BATCH_SIZE = int(os.getenv('DB_REPLAY_BATCH_SIZE', 5000))
+    REPLAY_INTERVAL = float(os.getenv('DB_REPLAY_INTERVAL', 2))
+    PROVISION = os.getenv('DB_PROVISION', 'no').lower() in ['true', '1', 'y', 'yes']
 
     db = None       # holder property for InfluxDB connenction
 
     log = logging.getLogger(__name__)
 
     def __init__(self):
-        """Initialization of InfluxDB connection in constructor."""
+        """Initialization of InfluxDB connection and writer thread."""
+        self._buffer = collections.deque()
+        self._buffer_lock = threading.Condition()
+        self._closing = False
+        self._writer = None
+        self._spool = None
+        self._db_down = False
+        self._next_replay = 0
+        self._provisioned = not self.PROVISION
+        self.dropped_points = 0
         if self.ENABLED:
             self.log.info("Open InfluxDB connection: %s", self.DB_NAME)
             self.db = InfluxDBClient(
@@ -28,14 +60,163 @@ class InfluxDBHandler(object):
                 self.DB_PORT,
                 self.DB_USER,
                 self.DB_PASS,
-                self.DB_NAME
+                self.DB_NAME,
+                gzip=self.DB_GZIP
         )
+            if self.SPOOL_PATH:
+                self._spool = PointSpool(self.SPOOL_PATH, self.SPOOL_MAX_POINTS)
+            self._writer = threading.Thread(
+                target=self._write_loop, name='influxdb-writer', daemon=True)
+            self._writer.start()
 
-    def write_measurements(self, data, measurement):
-        """Write inverter statistics."""
+    def write_measurements(self, data, measurement, tags=None, timestamp=None):
+        """Queue a copy of inverter statistics for writing."""
+        if timestamp is None:
+            timestamp = time.time_ns() // 1000000
+        # the caller keeps updating data in place, e.g. proto.status
+        self.put(Record(measurement, timestamp, dict(tags or {}), dict(data)))
+
+    def put(self, record):
+        """Queue a record of the sink pipeline for writing."""
         if self.db != None:
-            point = dict()
-            point['measurement'] = measurement
-            point['fields'] = data
-            self.log.debug("InfluxDB - write data points: {%s}", point)
-            self.db.write_points([point])
+            with self._buffer_lock:
+                self._append(record)
+
+    def _append(self, record):
+        point = dict()
+        point['measurement'] = record.measurement
+        point['time'] = record.time
+        if record.tags:
+            point['tags'] = dict(record.tags)
+        point['fields'] = record.fields
+        self.log.debug("InfluxDB - queue data point: {%s}", point)
+        if len(self._buffer) >= self.BUFFER_SIZE:
+            self._buffer.popleft()
+            self._drop_points(1)
+        self._buffer.append(point)
+        # wake the writer to start the age timer or to flush a batch
+        if len(self._buffer) in (1, self.BATCH_SIZE):
+            self._buffer_lock.notify()
+
+    def close(self):
+        """Flush buffered points and stop the writer thread."""
+        if self._writer is not None:
+            with self._buffer_lock:
+                self._closing = True
+                self._buffer_lock.notify()
+            self._writer.join(self.FLUSH_INTERVAL)
+
+    def _drop_points(self, count):
+        if self.dropped_points == 0:
+            self.log.warning("InfluxDB - buffer full, dropping oldest points.")
+        self.dropped_points += count
+
+    def _next_batch(self, timeout=None):
+        """Wait until a batch is due by count or age, then take it.
+
+        Returns an empty batch if nothing became due within timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._buffer_lock:
+            while not self._closing:
+                if len(self._buffer) >= self.BATCH_SIZE:
+                    break
+                wait = None
+                if self._buffer:
+                    age = time.time() - self._buffer[0]['time'] / 1000
+                    if age >= self.FLUSH_INTERVAL:
+                        break
+                    wait = self.FLUSH_INTERVAL - age
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return []
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._buffer_lock.wait(wait)
+            count = min(len(self._buffer), self.BATCH_SIZE)
+            return [self._buffer.popleft() for _ in range(count)]
+
+    def _requeue(self, batch):
+        """Put back a failed batch in front of newer points, space permitting."""
+        with self._buffer_lock:
+            room = max(self.BUFFER_SIZE - len(self._buffer), 0)
+            if room < len(batch):
+                self._drop_points(len(batch) - room)
+                batch = batch[len(batch) - room:]
+            self._buffer.extendleft(reversed(batch))
+
+    def _provision(self):
+        """Set up the retention tiers, the raw policy becomes the default.
+
+        Connection errors are raised to retry with the next write.
+        """
+        try:
+            RetentionTiers(self.db, self.DB_NAME).provision()
+        except InfluxDBClientError as err:
+            # e.g. no admin rights, points go on to the default policy
+            self.log.warning("InfluxDB - retention tiers not provisioned: %s", err)
+        self._provisioned = True
+
+    def _write(self, points) -> bool:
+        try:
+            if not self._provisioned:
+                self._provision()
+            self.db.write_points(points, time_precision='ms')
+        except Exception as err:
+            if not self._db_down:
+                self.log.warning("InfluxDB - write failed, spooling points: %s", err)
+            self._db_down = True
+            return False
+        if self._db_down:
+            self.log.info("InfluxDB - connection restored.")
+        self._db_down = False
+        return True
+
+    def _write_failed(self, batch):
+        if self._spool is not None:
+            self._spool.put(batch)
+        elif self._closing:
+            self.log.warning("InfluxDB - %d points lost on exit.", len(batch))
+        else:
+            self._requeue(batch)
+
+    def _replay_delay(self):
+        """Seconds until the next replay batch is due, None if nothing to do."""
+        if self._spool is None or len(self._spool) == 0:
+            return None
+        return max(self._next_replay - time.monotonic(), 0)
+
+    def _replay(self):
+        """Write one batch of spooled points, oldest first."""
+        if self._replay_delay() != 0:
+            return
+        ids, points = self._spool.peek(self.REPLAY_BATCH_SIZE)
+        if self._write(points):
+            self._spool.remove(ids)
+            self._next_replay = time.monotonic() + self.REPLAY_INTERVAL
+            self.log.info("InfluxDB - replayed %d spooled points, %d left.",
+                          len(ids), len(self._spool))
+        else:
+            self._next_replay = time.monotonic() + self.FLUSH_INTERVAL
+
+    def _write_loop(self):
+        while True:
+            batch = self._next_batch(self._replay_delay())
+            if batch:
+                # no new connection attempts for the rest of an exit while down
+                if (self._closing and self._db_down) or not self._write(batch):
+                    self._write_failed(batch)
+                    if not self._closing:
+                        time.sleep(self.FLUSH_INTERVAL)
+                    continue
+                self.log.debug("InfluxDB - wrote %d points.", len(batch))
+            elif self._closing:
+                break
+            if not self._closing:
+                self._replay()
+            with self._buffer_lock:
+                dropped, self.dropped_points = self.dropped_points, 0
+            if dropped:
+                self.log.warning("InfluxDB - %d points were dropped.", dropped)
+        if self._spool is not None:
+            self._spool.close()
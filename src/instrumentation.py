@@ -0,0 +1,132 @@
+"""Command instrumentation module."""
+import bisect
+import re
+import threading
+
+
+class Histogram(object):
+    """Latency histogram with fixed bucket bounds in seconds."""
+
+    BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self):
+        """Initialize empty histogram."""
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Add a duration."""
+        self.buckets[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q) -> float:
+        """Estimated quantile, interpolated within its bucket."""
+        rank = q * self.count
+        seen = 0
+        for position, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = self.BOUNDS[position - 1] if position else 0.0
+                upper = self.BOUNDS[position] if position < len(self.BOUNDS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return 0.0
+
+    def fields(self, prefix) -> dict:
+        """Summary fields: count, mean, max and p50/p90/p99."""
+        if not self.count:
+            return {prefix + '_count': 0}
+        return {
+            prefix + '_count': self.count,
+            prefix + '_mean': self.sum / self.count,
+            prefix + '_max': self.max,
+            prefix + '_p50': self.quantile(0.5),
+            prefix + '_p90': self.quantile(0.9),
+            prefix + '_p99': self.quantile(0.99),
+        }
+
+
+class CommandStats(object):
+    """Stage latencies and outcome counters of one command."""
+
+    STAGES = ('open', 'write', 'first_byte', 'frame', 'parse', 'total')
+    COUNTERS = ('attempts', 'retries', 'ok', 'nak', 'crc_error', 'timeout',
+                'io_error', 'failed', 'cached')
+
+    def __init__(self):
+        """Initialize empty histograms and zero counters."""
+        self.stages = {stage: Histogram() for stage in self.STAGES}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def fields(self) -> dict:
+        """Counters and histogram summaries as measurement fields."""
+        fields = dict(self.counters)
+        for stage, histogram in self.stages.items():
+            fields.update(histogram.fields(stage))
+        return fields
+
+
+class Instrumentation(object):
+    """Per-command timing histograms and counters of a protocol handler.
+
+    Statistics are collected per command name, setter arguments are left
+    out (PBCV50.0 counts as PBCV). export() returns and resets them, so
+    every export covers the interval since the previous one.
+    """
+
+    # serial status after a failed attempt -> counter
+    STATUS_COUNTERS = {
+        'CRC_ERROR': 'crc_error',
+        'RESPONSE_TIMEOUT': 'timeout',
+        'ERROR': 'io_error',
+        'CLOSED': 'io_error',
+    }
+
+    def __init__(self):
+        """Initialize empty statistics."""
+        self._commands = dict()
+        self._lock = threading.Lock()
+
+    def command(self, cmd) -> CommandStats:
+        """Statistics of a command, created on first use."""
+        name = re.match('[A-Z]*', cmd).group() or cmd
+        stats = self._commands.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self._commands.setdefault(name, CommandStats())
+        return stats
+
+    def attempt(self, cmd, response, status, timings):
+        """Record one send/receive attempt.
+
+        timings maps stage names to durations, missing stages are skipped.
+        """
+        stats = self.command(cmd)
+        stats.counters['attempts'] += 1
+        for stage, duration in timings.items():
+            if duration is not None:
+                stats.stages[stage].observe(duration)
+        if response == 'NAK':
+            stats.counters['nak'] += 1
+        elif response:
+            stats.counters['ok'] += 1
+        else:
+            stats.counters[self.STATUS_COUNTERS.get(status, 'io_error')] += 1
+
+    def count(self, cmd, counter):
+        """Increment a counter of a command."""
+        self.command(cmd).counters[counter] += 1
+
+    def observe(self, cmd, stage, duration):
+        """Record a stage duration of a command."""
+        self.command(cmd).stages[stage].observe(duration)
+
+    def export(self):
+        """(command, fields) of every used command since the last export."""
+        with self._lock:
+            commands, self._commands = self._commands, dict()
+        return [(name, stats.fields()) for name, stats in sorted(commands.items())]
@@ -1,9 +1,14 @@
 """InverterConfig class."""
 import logging
 import os
+from collections import namedtuple
+
 import yaml
 
-from voltronic_protocol import Voltronic
+from config_watcher import ConfigWatcher
+from voltronic_protocol import CommandRejectedError, Voltronic
+
+Change = namedtuple('Change', 'key name current value setter')
 
 
 class InverterConfig(object):
@@ -11,7 +16,52 @@ class InverterConfig(object):
 
     CONFIG = os.getenv('CONFIG', 'etc/solar/config.yaml')
 
-    icfg = dict()
+    # config key, device state dict, device state key, Voltronic setter, name
+    SETTINGS = (
+        ('inverter_source', 'rating', 'output_source_priority',
+         'set_inverter_source', 'inverter source'),
+        ('charger_source', 'rating', 'charger_source_priority',
+         'set_charger_source', 'charger source'),
+        ('max_ac_charging_current', 'rating', 'max_ac_charging_current',
+         'set_max_utility_charging_current', 'utility charging current'),
+        ('max_charging_current', 'rating', 'max_charging_current',
+         'set_max_charging_current', 'charging current'),
+        ('inverter_overload_bypass', 'flag', 'overload_bypass',
+         'set_flag_b', 'inverter overload bypass'),
+        ('inverter_overload_restart', 'flag', 'overload_restart',
+         'set_flag_u', 'inverter overload restart'),
+        ('inverter_overtemp_restart', 'flag', 'overtemperature_restart',
+         'set_flag_v', 'inverter overtemperature restart'),
+        ('inverter_alarm_on_psi', 'flag', 'primary_source_interrupt_alarm',
+         'set_flag_y', 'alarm on primary source interrupt'),
+        # voltages are only accepted with user battery type, set it first
+        ('battery_type', 'rating', 'battery_type',
+         'set_battery_type', 'battery type'),
+        ('battery_bulk_voltage', 'rating', 'battery_bulk_voltage',
+         'set_battery_bulk_voltage', 'battery bulk charge voltage'),
+        ('battery_float_voltage', 'rating', 'battery_float_voltage',
+         'set_battery_float_voltage', 'battery float charge voltage'),
+        ('battery_redischarge_voltage', 'rating', 'battery_redischarge_voltage',
+         'set_battery_redischarge_voltage', 'battery redischarge voltage'),
+        ('battery_recharge_voltage', 'rating', 'battery_recharge_voltage',
+         'set_battery_recharge_voltage', 'battery recharge voltage'),
+        ('battery_cutoff_voltage', 'rating', 'battery_under_voltage',
+         'set_battery_cutoff_voltage', 'battery cutoff voltage'),
+        ('inverter_output_quality', 'rating', 'output_quality',
+         'set_output_quality', 'output quality'),
+    )
+
+    VOLTAGE_KEYS = ('battery_bulk_voltage', 'battery_float_voltage',
+                    'battery_redischarge_voltage', 'battery_recharge_voltage',
+                    'battery_cutoff_voltage')
+
+    # lower, higher, strict: battery voltage orderings enforced by the inverter
+    VOLTAGE_CONSTRAINTS = (
+        ('battery_cutoff_voltage', 'battery_recharge_voltage', True),
+        ('battery_recharge_voltage', 'battery_redischarge_voltage', True),
+        ('battery_float_voltage', 'battery_bulk_voltage', False),
+    )
+
     log = logging.getLogger(__name__)
 
     def Icfg(cls):
@@ -27,7 +77,7 @@ class InverterConfig(object):
         self.log.debug("Loading configuration...")
         old_cfg = self.icfg.copy()
 
-        with open(self.CONFIG) as yaml_file:
+        with open(self.config) as yaml_file:
             # load yaml config file
             parsed_cfg = yaml.safe_load(yaml_file)
             # parse battery type
@@ -70,159 +120,128 @@ class InverterConfig(object):
 
         if self.icfg != old_cfg:
             self.log.info("Configuration loaded from [{}]."
-                          .format(self.CONFIG))
+                          .format(self.config))
 
 
-    def _check_config_parameter(self, curr_value, cfg_value, cfg_name, func):
-        self.log.debug("Check inverter configuration [{}]: {} -> {}."
-                       .format(cfg_name, curr_value, cfg_value))
-        if curr_value != cfg_value:
-            self.log.info("Modify inverter configuration [{}]: {} -> {}."
-                          .format(cfg_name, curr_value, cfg_value))
-            func(cfg_value)
-
-    def _check_inverter_source(self):
-        self._check_config_parameter(
-            self.proto.rating['output_source_priority'],
-            self.icfg['inverter_source'],
-            'inverter source',
-            self.proto.set_inverter_source
-        )
-
-    def _check_charger_source(self):
-        self._check_config_parameter(
-            self.proto.rating['charger_source_priority'],
-            self.icfg['charger_source'],
-            'charger source',
-            self.proto.set_charger_source
-        )
-
-    def _check_max_charging_current(self):
-        self._check_config_parameter(
-            self.proto.rating['max_charging_current'],
-            self.icfg['max_charging_current'],
-            'charging current',
-            self.proto.set_max_charging_current
-        )
-
-    def _check_max_utility_charging_current(self):
-        self._check_config_parameter(
-            self.proto.rating['max_ac_charging_current'],
-            self.icfg['max_ac_charging_current'],
-            'utility charging current',
-            self.proto.set_max_utility_charging_current
-        )
-
-    def _check_inverter_overload_bypass(self):
-        self._check_config_parameter(
-            self.proto.flag['overload_bypass'],
-            self.icfg['inverter_overload_bypass'],
-            'inverter overload bypass',
-            self.proto.set_flag_b
-        )
-
-    def _check_inverter_overload_restart(self):
-        self._check_config_parameter(
-            self.proto.flag['overload_restart'],
-            self.icfg['inverter_overload_restart'],
-            'inverter overload restart',
-            self.proto.set_flag_u
-        )
-
-    def _check_inverter_overtemp_restart(self):
-        self._check_config_parameter(
-            self.proto.flag['overtemperature_restart'],
-            self.icfg['inverter_overtemp_restart'],
-            'inverter overtemperature restart',
-            self.proto.set_flag_v
-        )
-
-    def _check_inverter_alarm_on_primary_source_interrupt(self):
-        self._check_config_parameter(
-            self.proto.flag['primary_source_interrupt_alarm'],
-            self.icfg['inverter_alarm_on_psi'],
-            'alarm on primary source interrupt',
-            self.proto.set_flag_y
-        )
-
-    def _check_output_quality(self):
-        self._check_config_parameter(
-            self.proto.rating['output_quality'],
-            self.icfg['inverter_output_quality'],
-            'output quality',
-            self.proto.set_output_quality
-        )
-
-    def _check_battery_type(self):
-        self._check_config_parameter(
-            self.proto.rating['battery_type'],
-            self.icfg['battery_type'],
-            'battery type',
-            self.proto.set_battery_type
-        )
-    def _check_battery_bulk_voltage(self):
-        self._check_config_parameter(
-            self.proto.rating['battery_bulk_voltage'],
-            self.icfg['battery_bulk_voltage'],
-            'battery bulk charge voltage',
-            self.proto.set_battery_bulk_voltage
-        )
-    def _check_battery_float_voltage(self):
-        self._check_config_parameter(
-            self.proto.rating['battery_float_voltage'],
-            self.icfg['battery_float_voltage'],
-            'battery float charge voltage',
-            self.proto.set_battery_float_voltage
-        )
-    def _check_battery_redischarge_voltage(self):
-        self._check_config_parameter(
-            self.proto.rating['battery_redischarge_voltage'],
-            self.icfg['battery_redischarge_voltage'],
-            'battery redischarge voltage',
-            self.proto.set_battery_redischarge_voltage
-        )
-    def _check_battery_recharge_voltage(self):
-        self._check_config_parameter(
-            self.proto.rating['battery_recharge_voltage'],
-            self.icfg['battery_recharge_voltage'],
-            'battery recharge voltage',
-            self.proto.set_battery_recharge_voltage
-        )
-    def _check_battery_cutoff_voltage(self):
-        self._check_config_parameter(
-            self.proto.rating['battery_under_voltage'],
-            self.icfg['battery_cutoff_voltage'],
-            'battery cutoff voltage',
-            self.proto.set_battery_cutoff_voltage
-        )
+    def _reload_config(self) -> bool:
+        """Reload configuration if the file changed, True if reloaded.
 
+        An invalid file is reported once and the previous configuration is
+        kept, it is tried again only when its content changes.
+        """
+        if not self._watcher.changed():
+            return False
+        previous = self.icfg.copy()
+        try:
+            self._load_config()
+        except Exception as err:
+            self.icfg = previous
+            self.log.error("Configuration [{}] not loaded, {}: {}"
+                           .format(self.config, type(err).__name__, err))
+            return False
+        return True
+
+    def _diff(self):
+        """Settings differing between the device state and the config."""
+        changes = []
+        for cfg_key, state_name, state_key, setter_name, cfg_name in self.SETTINGS:
+            curr_value = getattr(self.proto, state_name)[state_key]
+            cfg_value = self.icfg[cfg_key]
+            self.log.debug("Check inverter configuration [{}]: {} -> {}."
+                           .format(cfg_name, curr_value, cfg_value))
+            if curr_value != cfg_value:
+                changes.append(Change(cfg_key, cfg_name, curr_value, cfg_value,
+                                      getattr(self.proto, setter_name)))
+        return changes
+
+    def _voltages(self):
+        """Current battery voltage settings by config key."""
+        return {cfg_key: self.proto.rating[state_key]
+                for cfg_key, state_name, state_key, _, _ in self.SETTINGS
+                if cfg_key in self.VOLTAGE_KEYS}
+
+    @classmethod
+    def _voltage_violations(cls, voltages):
+        """Voltage ordering constraints the given settings violate."""
+        violations = set()
+        for lower, higher, strict in cls.VOLTAGE_CONSTRAINTS:
+            if higher == 'battery_redischarge_voltage' and voltages[higher] == 0:
+                continue    # 0 means re-discharge when the battery is full
+            if voltages[lower] > voltages[higher] or \
+                    (strict and voltages[lower] == voltages[higher]):
+                violations.add((lower, higher))
+        return violations
+
+    def _plan_changes(self):
+        """Ordered changes bringing the inverter to the configuration.
+
+        Battery voltage writes are ordered so every intermediate state keeps
+        the inverter's voltage constraints, otherwise it refuses the write.
+        """
+        pending = self._diff()
+        voltages = self._voltages()
+        if self._voltage_violations({key: self.icfg[key] for key in voltages}):
+            self.log.warning("Configured battery voltages violate the inverter "
+                             "constraints, some writes will be rejected.")
+        changes = []
+        while pending:
+            violations = self._voltage_violations(voltages)
+            for change in pending:
+                if change.key not in voltages:
+                    break
+                trial = dict(voltages, **{change.key: change.value})
+                if self._voltage_violations(trial) <= violations:
+                    break
+            else:
+                change = pending[0]
+            pending.remove(change)
+            if change.key in voltages:
+                voltages[change.key] = change.value
+            self.log.info("Modify inverter configuration [{}]: {} -> {}."
+                          .format(change.name, change.current, change.value))
+            changes.append(change)
+        return changes
+
+    def _apply_change(self, change) -> bool:
+        try:
+            change.setter(change.value)
+        except CommandRejectedError as err:
+            self.log.warning("Inverter rejected configuration [{}]: {}."
+                             .format(change.name, err))
+            return False
+        return True
+
+    def _verify(self, changes):
+        """Compare the read back device state to the applied changes."""
+        failed = {change.key for change in self._diff()}
+        for change in changes:
+            if change.key in failed:
+                self.log.error("Inverter configuration [{}] not applied: {} -> {}."
+                               .format(change.name, change.current, change.value))
 
     def _check_inverter_configuration(self):
-        self._load_config()
+        self._reload_config()
+        if not self.icfg:
+            return  # no valid configuration loaded yet
 
         self.proto.get_device_rating()
         self.proto.get_options()
 
-        self._check_inverter_source()
-        self._check_charger_source()
-        self._check_max_utility_charging_current()
-        self._check_max_charging_current()
-        self._check_inverter_overload_bypass()
-        self._check_inverter_overload_restart()
-        self._check_inverter_overtemp_restart()
-        self._check_inverter_alarm_on_primary_source_interrupt()
-        self._check_battery_type()
-        self._check_battery_bulk_voltage()
-        self._check_battery_float_voltage()
-        self._check_battery_redischarge_voltage()
-        self._check_battery_recharge_voltage()
-        self._check_battery_cutoff_voltage()
-        self._check_output_quality()
+        changes = self._plan_changes()
+        if not changes:
+            return
+        for change in changes:
+            self._apply_change(change)
 
+        # setters invalidated the cached state, read back once
         self.proto.get_device_rating()
         self.proto.get_options()
+        self._verify(changes)
 
 
-    def __init__(self, proto: Voltronic):
+    def __init__(self, proto: Voltronic, config=None):
         """Initialize inverter configuration."""
         self.proto = proto
+        self.config = config or self.CONFIG
+        self.icfg = dict()
+        self._watcher = ConfigWatcher(self.config)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""Simulated Voltronic inverters on pseudo-terminals.
+
+Each virtual inverter speaks PI30 with CRC on its own pty and keeps a
+mutable device state changed by the P* setter commands. Latency, serial
+line pacing, CRC errors, NAKs and timeouts can be injected. Many virtual
+inverters are served by one thread, e.g.
+
+    python inverter_simulator.py --count 4 --inverters-file /tmp/inverters.yaml
+
+and the controller runs against them with INVERTERS=/tmp/inverters.yaml.
+"""
+import argparse
+import heapq
+import itertools
+import logging
+import math
+import os
+import random
+import selectors
+import signal
+import threading
+import time
+import tty
+
+from serial_communicator import SerCom
+
+
+class VirtualInverter(object):
+    """PI30 device state and command handling of one simulated inverter."""
+
+    QPIRI_FORMAT = (
+        '{grid_voltage:05.1f} {grid_current:04.1f} {ac_output_voltage:05.1f} '
+        '{ac_output_frequency:04.1f} {ac_output_current:04.1f} '
+        '{ac_output_apparent_power:04d} {ac_output_active_power:04d} '
+        '{battery_nominal_voltage:04.1f} {battery_recharge_voltage:04.1f} '
+        '{battery_under_voltage:04.1f} {battery_bulk_voltage:04.1f} '
+        '{battery_float_voltage:04.1f} {battery_type:d} {max_ac_charging_current:02d} '
+        '{max_charging_current:03d} {output_quality:d} {output_source_priority:d} '
+        '{charger_source_priority:d} {parallel_max_num:d} {machine_type:02d} '
+        '{topology:d} {output_mode:d} {battery_redischarge_voltage:04.1f} '
+        '{pv_ok_condition:d} {pv_power_balance:d}')
+
+    QPIGS_FORMAT = (
+        '{grid_voltage:05.1f} {grid_frequency:04.1f} {ac_output_voltage:05.1f} '
+        '{ac_output_frequency:04.1f} {ac_output_apparent_power:04d} '
+        '{ac_output_active_power:04d} {output_load_percent:03d} {bus_voltage:03d} '
+        '{battery_voltage:05.2f} {battery_charging_current:03d} {battery_capacity:03d} '
+        '{heat_sink_temperature:04d} {pv_input_current:04d} {pv_input_voltage:05.1f} '
+        '{scc_battery_voltage:05.2f} {battery_discharge_current:05d} {status_bits:08b} '
+        '00 00 {pv_charging_power:05d} 010')
+
+    # setter command -> rating key, argument converter
+    RATING_SETTERS = {
+        'POP': ('output_source_priority', int),
+        'PCP': ('charger_source_priority', int),
+        'PGR': ('output_quality', int),
+        'PBT': ('battery_type', int),
+        'PCVV': ('battery_bulk_voltage', float),
+        'PBFT': ('battery_float_voltage', float),
+        'PBDV': ('battery_redischarge_voltage', float),
+        'PBCV': ('battery_recharge_voltage', float),
+        'PSDV': ('battery_under_voltage', float),
+        'MCHGC': ('max_charging_current', int),
+        'MUCHGC': ('max_ac_charging_current', int),
+    }
+
+    FLAG_LETTERS = 'abjkuvxyz'
+
+    def __init__(self, name='sim', latency=0.05, crc_error_rate=0.0,
+                 nak_rate=0.0, timeout_rate=0.0, seed=None):
+        """Initialize device state and fault injection rates."""
+        self.name = name
+        self.latency = latency
+        self.crc_error_rate = crc_error_rate
+        self.nak_rate = nak_rate
+        self.timeout_rate = timeout_rate
+        self.random = random.Random(seed)
+        self.mode = 'B'
+        self.warning_bits = 0
+        self.enabled_flags = set('akxz')
+        self.rating = {
+            'grid_voltage': 230.0, 'grid_current': 13.0,
+            'ac_output_voltage': 230.0, 'ac_output_frequency': 50.0,
+            'ac_output_current': 13.0, 'ac_output_apparent_power': 3000,
+            'ac_output_active_power': 3000, 'battery_nominal_voltage': 48.0,
+            'battery_recharge_voltage': 46.0, 'battery_under_voltage': 42.0,
+            'battery_bulk_voltage': 56.4, 'battery_float_voltage': 54.0,
+            'battery_type': 0, 'max_ac_charging_current': 30,
+            'max_charging_current': 60, 'output_quality': 0,
+            'output_source_priority': 0, 'charger_source_priority': 2,
+            'parallel_max_num': 1, 'machine_type': 0, 'topology': 0,
+            'output_mode': 0, 'battery_redischarge_voltage': 54.0,
+            'pv_ok_condition': 0, 'pv_power_balance': 1,
+        }
+        self.commands = 0
+        self._rx_buffer = bytearray()
+
+    def _status(self):
+        """Slowly varying operational values with a bit of noise."""
+        now = time.time()
+        daylight = max(math.sin((now % 86400) / 86400 * 2 * math.pi - math.pi / 2), 0)
+        pv_power = int(2500 * daylight * self.random.uniform(0.9, 1.0))
+        load = int(400 + 300 * self.random.random())
+        battery_voltage = 51.0 + 2 * daylight + self.random.uniform(-0.05, 0.05)
+        battery_current = (pv_power - load) / battery_voltage
+        return {
+            'grid_voltage': 231.0 + self.random.uniform(-2, 2), 'grid_frequency': 50.0,
+            'ac_output_voltage': 230.0, 'ac_output_frequency': 50.0,
+            'ac_output_apparent_power': int(load * 1.1), 'ac_output_active_power': load,
+            'output_load_percent': load * 100 // 3000, 'bus_voltage': 380,
+            'battery_voltage': battery_voltage,
+            'battery_charging_current': max(int(battery_current), 0),
+            'battery_capacity': int(60 + 40 * daylight),
+            'heat_sink_temperature': 35, 'pv_input_current': int(pv_power / 250),
+            'pv_input_voltage': 250.0 if pv_power else 0.0,
+            'scc_battery_voltage': battery_voltage,
+            'battery_discharge_current': max(int(-battery_current), 0),
+            'status_bits': 0b00010110 if pv_power else 0b00010000,
+            'pv_charging_power': pv_power,
+        }
+
+    def _voltages_valid(self, rating):
+        if rating['battery_float_voltage'] > rating['battery_bulk_voltage']:
+            return False
+        if rating['battery_under_voltage'] >= rating['battery_recharge_voltage']:
+            return False
+        redischarge = rating['battery_redischarge_voltage']
+        return redischarge == 0 or rating['battery_recharge_voltage'] < redischarge
+
+    def _set(self, command, argument):
+        key, convert = self.RATING_SETTERS[command]
+        rating = dict(self.rating)
+        rating[key] = convert(argument)
+        if convert is float:
+            if rating['battery_type'] != 2:
+                return 'NAK'        # voltages only settable with user battery type
+            if not self._voltages_valid(rating):
+                return 'NAK'
+        self.rating = rating
+        return 'ACK'
+
+    def handle(self, cmd: str) -> str:
+        """Response payload to a command, without '(' and CRC."""
+        self.commands += 1
+        if cmd == 'QPIGS':
+            return self.QPIGS_FORMAT.format(**self._status())
+        if cmd == 'QPIRI':
+            return self.QPIRI_FORMAT.format(**self.rating)
+        if cmd == 'QPIWS':
+            return format(self.warning_bits, '036b')
+        if cmd == 'QMOD':
+            return self.mode
+        if cmd == 'QFLAG':
+            disabled = ''.join(sorted(set(self.FLAG_LETTERS) - self.enabled_flags))
+            return 'E' + ''.join(sorted(self.enabled_flags)) + 'D' + disabled
+        if cmd == 'QPI':
+            return 'PI30'
+        if cmd == 'QID':
+            return '9293200410{:04d}'.format(abs(hash(self.name)) % 10000)
+        if cmd in ('QVFW', 'QVFW2'):
+            return 'VERFW:00072.70'
+        if cmd[:2] in ('PE', 'PD') and set(cmd[2:]) <= set(self.FLAG_LETTERS):
+            if cmd[:2] == 'PE':
+                self.enabled_flags |= set(cmd[2:])
+            else:
+                self.enabled_flags -= set(cmd[2:])
+            return 'ACK'
+        for command in self.RATING_SETTERS:
+            argument = cmd[len(command):]
+            if cmd.startswith(command) and argument.replace('.', '').isdigit():
+                return self._set(command, argument)
+        return 'NAK'
+
+    def received(self, data):
+        """Feed bytes from the line, returns complete response frames."""
+        self._rx_buffer.extend(data)
+        frames = []
+        while True:
+            frame_end = self._rx_buffer.find(SerCom.CR)
+            if frame_end < 0:
+                return frames
+            request = bytes(self._rx_buffer[:frame_end])
+            del self._rx_buffer[:frame_end + 1]
+            response = self._respond(request)
+            if response is not None:
+                frames.append(response)
+
+    def _respond(self, request):
+        if self.random.random() < self.timeout_rate:
+            return None
+        cmd = request[:-2].decode('ascii', errors='replace')
+        if SerCom._get_crc(request[:-2]) != request[-2:]:
+            payload = 'NAK'
+        elif self.random.random() < self.nak_rate:
+            payload = 'NAK'
+        else:
+            payload = self.handle(cmd)
+        frame = bytearray(b'(' + payload.encode('ascii'))
+        crc = bytearray(SerCom._get_crc(bytes(frame)))
+        if self.random.random() < self.crc_error_rate:
+            crc[0] ^= 0x01
+        return bytes(frame + crc + SerCom.CR)
+
+
+class InverterSimulator(object):
+    """Serve virtual inverters on pseudo-terminals from one thread."""
+
+    CHUNK_SIZE = 8      # bytes written at once when pacing the line
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, baudrate=2400):
+        """Initialize simulator, baudrate 0 disables line pacing."""
+        self.baudrate = baudrate
+        self.inverters = []
+        self._selector = selectors.DefaultSelector()
+        self._pending = []      # heap of (time, sequence, fd, bytes)
+        self._sequence = itertools.count()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._fds = []
+
+    def add(self, inverter: VirtualInverter) -> str:
+        """Attach a virtual inverter to a new pty, returns its port name."""
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        inverter.port = os.ttyname(slave)
+        self._fds.extend((master, slave))
+        self._selector.register(master, selectors.EVENT_READ, inverter)
+        self.inverters.append(inverter)
+        return inverter.port
+
+    def _schedule(self, fd, frame, start):
+        byte_time = 10 / self.baudrate if self.baudrate else 0
+        for offset in range(0, len(frame), self.CHUNK_SIZE):
+            chunk = frame[offset:offset + self.CHUNK_SIZE]
+            due = start + (offset + len(chunk)) * byte_time
+            heapq.heappush(self._pending, (due, next(self._sequence), fd, chunk))
+
+    def _flush_due(self):
+        now = time.monotonic()
+        while self._pending and self._pending[0][0] <= now:
+            _, _, fd, chunk = heapq.heappop(self._pending)
+            try:
+                os.write(fd, chunk)
+            except OSError:
+                pass
+
+    def run(self):
+        """Serve until stopped."""
+        while not self._stopped.is_set():
+            timeout = 0.1
+            if self._pending:
+                timeout = min(max(self._pending[0][0] - time.monotonic(), 0), timeout)
+            for key, _ in self._selector.select(timeout):
+                try:
+                    data = os.read(key.fd, 1024)
+                except OSError:
+                    continue
+                inverter = key.data
+                for frame in inverter.received(data):
+                    self._schedule(key.fd, frame, time.monotonic() + inverter.latency)
+            self._flush_due()
+
+    def start(self):
+        """Serve from a background thread."""
+        self._thread = threading.Thread(target=self.run, name='simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and release the ptys."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._selector.close()
+        for fd in self._fds:
+            os.close(fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=1, help='number of inverters')
+    parser.add_argument('--baud', type=int, default=2400, help='line pacing, 0: none')
+    parser.add_argument('--latency', type=float, default=0.05, help='response delay [s]')
+    parser.add_argument('--crc-error-rate', type=float, default=0.0)
+    parser.add_argument('--nak-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--inverters-file', help='write an INVERTERS yaml file')
+    parser.add_argument('--config', default='etc/solar/config.yaml',
+                        help='config file referenced in the INVERTERS file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = InverterSimulator(args.baud)
+    for number in range(args.count):
+        name = 'sim{}'.format(number)
+        seed = None if args.seed is None else args.seed + number
+        port = simulator.add(VirtualInverter(
+            name, args.latency, args.crc_error_rate, args.nak_rate,
+            args.timeout_rate, seed))
+        print('{} {}'.format(name, port), flush=True)
+    if args.inverters_file:
+        import yaml
+        with open(args.inverters_file, 'w') as yaml_file:
+            yaml.safe_dump([{'name': inverter.name, 'port': inverter.port,
+                             'config': args.config}
+                            for inverter in simulator.inverters], yaml_file)
+    signal.signal(signal.SIGTERM, lambda sig, frame: simulator._stopped.set())
+    try:
+        simulator.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Inverter worker module."""
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+import inverter_configurator
+import serial_communicator
+import voltronic_protocol
+from adaptive_rate import AdaptiveRate
+from energy_counter import EnergyCounter
+from fixed_rate_scheduler import FixedRateScheduler
+from frame_recorder import FrameRecorder
+from ring_buffer import RingBuffer
+
+
+class InverterWorker(threading.Thread):
+    """Polling and configuration thread of one inverter on its own port."""
+
+    INVERTERS = os.getenv('INVERTERS')     # yaml list of inverters: name, port, config
+    INVERTER_NAME = os.getenv('INVERTER_NAME', 'inverter')
+    POLL_QPIGS = float(os.getenv('POLL_QPIGS', 5))
+    POLL_QPIWS = float(os.getenv('POLL_QPIWS', 5))
+    POLL_QMOD = float(os.getenv('POLL_QMOD', 5))
+    SETUP_INTERVAL = float(os.getenv('SETUP_INTERVAL', 30))
+    CONFIG_CHECK_INTERVAL = float(os.getenv('CONFIG_CHECK_INTERVAL', 1))
+    STATS_INTERVAL = float(os.getenv('STATS_INTERVAL', 60))
+    ENERGY_COUNTERS = os.getenv('ENERGY_COUNTERS', 'yes').lower() in ['true', '1', 'y', 'yes']
+    RING_SIZE = int(os.getenv('RING_SIZE', 0))     # QPIGS samples kept, 0: no ring
+    RING_DUMP_DIR = os.getenv('RING_DUMP_DIR', 'var/solar')
+
+    log = logging.getLogger(__name__)
+
+    @classmethod
+    def load_inverters(cls):
+        """Inverter list from INVERTERS file or the single inverter defaults."""
+        if not cls.INVERTERS:
+            return [{
+                'name': cls.INVERTER_NAME,
+                'port': serial_communicator.SerCom.SERIAL_PORT_NAME,
+                'config': inverter_configurator.InverterConfig.CONFIG
+            }]
+        with open(cls.INVERTERS) as yaml_file:
+            return yaml.safe_load(yaml_file)
+
+    def __init__(self, name, port, config, db, metrics=None):
+        """Initialize inverter handlers."""
+        super().__init__(name=name, daemon=True)
+        self.tags = {'inverter': name}
+        self.proto = voltronic_protocol.Voltronic(port)
+        self.icfg = inverter_configurator.InverterConfig(self.proto, config)
+        self.db = db
+        self.metrics = metrics
+        self.adaptive = AdaptiveRate(self.POLL_QPIGS) if AdaptiveRate.ENABLED else None
+        self.energy = EnergyCounter(name) if self.ENERGY_COUNTERS else None
+        self.recorder = FrameRecorder(name) if FrameRecorder.ENABLED else None
+        if self.recorder is not None:
+            self.proto.record_frames(self.recorder)
+        self.ring = None
+        if self.RING_SIZE:
+            self.ring = RingBuffer(voltronic_protocol.Voltronic.QPIGS_PARSER, self.RING_SIZE)
+        self._stop_event = threading.Event()
+        self.scheduler = FixedRateScheduler(self._delay)
+        self.scheduler.add('config', self.CONFIG_CHECK_INTERVAL, self.watch_config, 1)
+        self.scheduler.add('setup', self.SETUP_INTERVAL, self.setup_loop, 1)
+        self.scheduler.add('QPIWS', self.POLL_QPIWS, self.poll_warning_status, 2)
+        self.scheduler.add('QMOD', self.POLL_QMOD, self.poll_device_mode, 3)
+        qpigs_period = self.adaptive.period if self.adaptive else self.POLL_QPIGS
+        self.scheduler.add('QPIGS', qpigs_period, self.poll_operational_status, 4)
+        self.scheduler.add('stats', self.STATS_INTERVAL, self.report_stats, 5)
+
+    def _delay(self, seconds):
+        """Scheduler delay, interrupted and emptying the queue on stop."""
+        if self._stop_event.wait(seconds):
+            self.scheduler.cancel_all()
+
+    def write_measurements(self, data, measurement, timestamp=None, **tags):
+        """Write measurement tagged with the inverter name."""
+        self.db.write_measurements(data, measurement, dict(self.tags, **tags), timestamp)
+
+    def _guarded(self, task_name, func):
+        """Run func, logging failures and recording link reachability."""
+        self.log.debug('[%s] ---> %s started --->', self.name, task_name)
+        try:
+            func()
+        except voltronic_protocol.VoltronicError as err:
+            self.log.warning('[%s] %s failed: %s', self.name, task_name, err)
+            self.write_measurements({'reachable': False}, 'link_status')
+        except Exception:
+            self.log.exception('[%s] %s failed.', self.name, task_name)
+        else:
+            self.write_measurements({'reachable': True}, 'link_status')
+            if self.metrics is not None:
+                self.metrics.update(self.name, self.proto)
+        self.log.debug('[%s] <--- %s finished.', self.name, task_name)
+
+    def poll_warning_status(self):
+        self._guarded('QPIWS poll', self._poll_warning_status)
+
+    def _poll_warning_status(self):
+        self.proto.get_warning_status()
+        self._observe('warning', tuple(self.proto.warning.values()))
+        self.write_measurements(self.proto.warning, 'warning_status')
+
+    def poll_device_mode(self):
+        self._guarded('QMOD poll', self._poll_device_mode)
+
+    def _poll_device_mode(self):
+        self.proto.get_device_mode()
+        self._observe('device_mode', self.proto.device_mode)
+        self.write_measurements({'mode': self.proto.device_mode.name}, 'device_mode')
+
+    def poll_operational_status(self):
+        self._guarded('QPIGS poll', self._poll_operational_status)
+
+    def _poll_operational_status(self):
+        self.proto.get_operational_status()
+        if self.adaptive is not None:
+            self._adapt_poll_rate()
+        if self.energy is not None:
+            self.write_measurements(self.energy.add(time.time(), self.proto.status), 'energy')
+        if self.ring is None:
+            self.write_measurements(self.proto.status, 'operational_status')
+            return
+        # raw samples stay in the ring, only the rollups are written
+        for rollup in self.ring.append(time.time(), self.proto.status):
+            self._write_rollup(*rollup)
+
+    def _observe(self, name, value):
+        if self.adaptive is not None:
+            self.adaptive.observe(name, value)
+
+    def _adapt_poll_rate(self):
+        """Set the QPIGS period by activity, within the link budget."""
+        qpigs = self.scheduler.tasks['QPIGS']
+        other_load = sum(task.last_duration / task.period
+                         for task in self.scheduler.tasks.values() if task is not qpigs)
+        self.scheduler.set_period('QPIGS', self.adaptive.update(
+            self.proto.status, qpigs.last_duration, other_load))
+
+    def _write_rollup(self, name, start, fields):
+        self.write_measurements(fields, 'operational_status_' + name, int(start * 1000))
+
+    def dump_ring(self):
+        """Write the raw QPIGS samples of the ring to a CSV file."""
+        if self.ring is None:
+            return
+        os.makedirs(self.RING_DUMP_DIR, exist_ok=True)
+        self.ring.dump(os.path.join(self.RING_DUMP_DIR, '{}-qpigs-{}.csv'.format(
+            self.name, time.strftime('%Y%m%d-%H%M%S'))))
+
+    def setup_loop(self):
+        self._guarded('SETUP loop', self.icfg._check_inverter_configuration)
+
+    def watch_config(self):
+        """Run the setup loop at once when the configuration file changed."""
+        try:
+            changed = self.icfg._reload_config()
+        except Exception:
+            # an exception escaping a task would stop the scheduler
+            self.log.exception('[%s] Configuration check failed.', self.name)
+            return
+        if changed:
+            self.setup_loop()
+
+    def report_stats(self):
+        """Write timing statistics of every task and serial command."""
+        try:
+            for task in self.scheduler.tasks.values():
+                self.write_measurements(task.stats(), 'scheduler', task=task.name)
+            for command, fields in self.proto.instrumentation.export():
+                self.write_measurements(fields, 'command_stats', command=command)
+        except Exception:
+            self.log.exception('[%s] Statistics report failed.', self.name)
+
+    def run(self):
+        """Run the loops until stopped."""
+        self.setup_loop()
+        self.scheduler.run()
+        self.proto.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.energy is not None:
+            self.energy.save()
+        if self.ring is not None:
+            # partial periods are written too, instead of being lost
+            for rollup in self.ring.rollups:
+                completed = rollup.flush()
+                if completed is not None:
+                    self._write_rollup(rollup.name, *completed)
+
+    def stop(self):
+        """Ask the loops to finish."""
+        self._stop_event.set()
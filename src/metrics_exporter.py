@@ -0,0 +1,116 @@
+"""Prometheus metrics exporter module."""
+import http.server
+import logging
+import os
+import threading
+import time
+from enum import Enum
+
+from voltronic_protocol import Voltronic
+
+
+class MetricsExporter(object):
+    """Serve the latest inverter values in the Prometheus text format.
+
+    The exposition is rendered once per poll into a byte string, so a
+    scrape only sends that snapshot, without serial I/O or formatting.
+    """
+
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 0))     # 0: disabled
+    METRICS_ADDRESS = os.getenv('METRICS_ADDRESS', '')
+    PREFIX = 'solar_'
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, port=None):
+        """Initialize the snapshot and start serving it if a port is set."""
+        self.port = self.METRICS_PORT if port is None else port
+        self.snapshot = b''
+        self._samples = dict()      # inverter -> [(family, help, labels, value)]
+        self._lock = threading.Lock()
+        self._server = None
+        if self.port:
+            self._server = http.server.ThreadingHTTPServer(
+                (self.METRICS_ADDRESS, self.port), self._handler())
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever,
+                             name='metrics', daemon=True).start()
+            self.log.info("Serving metrics on port %s.", self._server.server_address[1])
+
+    def _handler(self):
+        exporter = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                snapshot = exporter.snapshot
+                self.send_response(200)
+                self.send_header('Content-Type', exporter.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(snapshot)))
+                self.end_headers()
+                self.wfile.write(snapshot)
+
+            def log_message(self, format, *args):
+                exporter.log.debug(format, *args)
+
+        return MetricsHandler
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, Enum):
+            value = value.value
+        return repr(float(value))
+
+    @staticmethod
+    def _label(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def _gauges(self, values, family_prefix, help_prefix, labels):
+        for name, value in values.items():
+            if value is not None:
+                yield (self.PREFIX + family_prefix + name, help_prefix + name,
+                       labels, self._value(value))
+
+    def _flags(self, values, family, help_text, label, labels):
+        for name, value in values.items():
+            yield (self.PREFIX + family, help_text,
+                   '{},{}="{}"'.format(labels, label, name), self._value(value))
+
+    def update(self, inverter, proto):
+        """Render the current values of an inverter into the snapshot."""
+        labels = 'inverter="{}"'.format(self._label(inverter))
+        samples = list(self._gauges(proto.status, 'status_', 'QPIGS ', labels))
+        samples.extend(self._gauges(proto.rating, 'rating_', 'QPIRI ', labels))
+        samples.extend(self._flags(proto.warning, 'warning', 'QPIWS warnings', 'warning', labels))
+        samples.extend(self._flags(proto.fault, 'fault', 'QPIWS faults', 'fault', labels))
+        samples.extend(self._flags(proto.flag, 'flag', 'QFLAG device options', 'option', labels))
+        if proto.device_mode is not None:
+            samples.extend(self._flags(
+                {mode.name: mode == proto.device_mode for mode in Voltronic.DeviceMode},
+                'device_mode', 'QMOD device mode', 'mode', labels))
+        samples.append((self.PREFIX + 'last_update_timestamp_seconds',
+                        'Time of the last successful poll', labels, repr(time.time())))
+        with self._lock:
+            self._samples[inverter] = samples
+            self.snapshot = self._render()
+
+    def _render(self):
+        families = dict()
+        for samples in self._samples.values():
+            for family, help_text, labels, value in samples:
+                if family not in families:
+                    families[family] = [
+                        '# HELP {} {}'.format(family, help_text),
+                        '# TYPE {} gauge'.format(family)]
+                families[family].append('{}{{{}}} {}'.format(family, labels, value))
+        return ''.join(line + '\n' for lines in families.values()
+                       for line in lines).encode('utf-8')
+
+    def close(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
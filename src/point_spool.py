@@ -0,0 +1,76 @@
+"""Durable point spool module."""
+import json
+import logging
+import os
+import sqlite3
+
+
+class PointSpool(object):
+    """SQLite backed spool of points waiting for an unreachable database.
+
+    The spool is capped at max_points, the oldest points are evicted first.
+    Points are handed back for replay in timestamp order.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, path, max_points):
+        """Open or create the spool file."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_points = max_points
+        self._db = sqlite3.connect(path, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS points ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'time INTEGER NOT NULL, '
+                         'point TEXT NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS points_time '
+                         'ON points (time, id)')
+        self._count = self._db.execute('SELECT COUNT(*) FROM points').fetchone()[0]
+        if self._count:
+            self.log.info("Spool [%s] holds %d points.", path, self._count)
+
+    def __len__(self):
+        """Number of spooled points."""
+        return self._count
+
+    def put(self, points):
+        """Append points, evicting the oldest ones above the size cap."""
+        with self._db:
+            self._db.execute('BEGIN')
+            self._db.executemany(
+                'INSERT INTO points (time, point) VALUES (?, ?)',
+                ((point['time'], json.dumps(point)) for point in points))
+            self._count += len(points)
+            excess = self._count - self.max_points
+            if excess > 0:
+                self._db.execute(
+                    'DELETE FROM points WHERE id IN '
+                    '(SELECT id FROM points ORDER BY time, id LIMIT ?)',
+                    (excess,))
+                self._count -= excess
+                self.log.warning("Spool full, evicted %d oldest points.", excess)
+
+    def peek(self, limit):
+        """Oldest spooled points as (ids, points), without removing them."""
+        rows = self._db.execute(
+            'SELECT id, point FROM points ORDER BY time, id LIMIT ?',
+            (limit,)).fetchall()
+        return [row[0] for row in rows], [json.loads(row[1]) for row in rows]
+
+    def remove(self, ids):
+        """Remove replayed points."""
+        with self._db:
+            self._db.execute('BEGIN')
+            self._db.executemany('DELETE FROM points WHERE id = ?',
+                                 ((point_id,) for point_id in ids))
+        self._count -= len(ids)
+
+    def close(self):
+        """Close the spool file."""
+        self._db.close()
@@ -0,0 +1,81 @@
+"""Table-driven response parser module.
+
+Schemas are prepared once into (name, index, converter) tuples and bit
+tables, so parsing a response costs one split plus one conversion per
+field.
+"""
+from enum import Enum
+
+
+class BitField(object):
+    """Bit table of named flags packed in a binary digit string."""
+
+    def __init__(self, bits):
+        """Store bit table of (name, mask) pairs."""
+        self.bits = tuple(bits)
+
+    @property
+    def names(self):
+        """Flag names in table order."""
+        return tuple(name for name, _ in self.bits)
+
+    def decode(self, bits: int, result=None) -> dict:
+        """Decode flags of an already converted integer into result."""
+        if result is None:
+            result = {}
+        for name, mask in self.bits:
+            result[name] = bool(bits & mask)
+        return result
+
+    def __call__(self, value: str, result=None) -> dict:
+        """Decode flags of a binary digit string, e.g. '00010110'."""
+        return self.decode(int(value, 2), result)
+
+
+class ResponseParser(object):
+    """Parser of whitespace separated response fields.
+
+    The schema is a sequence of (name, index, type) entries. The type is a
+    converter callable (float, int), an Enum class whose member values are
+    the raw field values, or a BitField expanding to several named flags
+    (its name is ignored).
+    """
+
+    def __init__(self, schema):
+        """Prepare the converter or bit table of every field of schema."""
+        self.schema = tuple(schema)
+        self._fields = tuple(
+            (name, index, None, field_type.bits) if isinstance(field_type, BitField)
+            else (name, index, self._converter(field_type), None)
+            for name, index, field_type in self.schema)
+
+    @staticmethod
+    def _converter(field_type):
+        if isinstance(field_type, type) and issubclass(field_type, Enum):
+            return {str(member.value): member for member in field_type}.__getitem__
+        return field_type
+
+    @property
+    def names(self):
+        """Names of all produced fields."""
+        names = []
+        for name, _, field_type in self.schema:
+            if isinstance(field_type, BitField):
+                names.extend(field_type.names)
+            else:
+                names.append(name)
+        return tuple(names)
+
+    def __call__(self, response: str, result=None) -> dict:
+        """Parse a response, storing fields into result (a new dict if None)."""
+        if result is None:
+            result = {}
+        values = response.split()
+        for name, index, converter, bits in self._fields:
+            if bits is None:
+                result[name] = converter(values[index])
+                continue
+            flags = int(values[index], 2)
+            for flag, mask in bits:
+                result[flag] = bool(flags & mask)
+        return result
@@ -0,0 +1,137 @@
+"""InfluxDB retention tier provisioning module."""
+import hashlib
+import logging
+import os
+import re
+
+from energy_counter import EnergyCounter
+from voltronic_protocol import Voltronic
+
+
+class RetentionTiers(object):
+    """Tiered retention policies with continuous query rollups.
+
+    Points are written to the raw policy, made the default. Continuous
+    queries roll them up per minute and the minute rollups per hour, each
+    tier kept for its own duration. Numeric fields are averaged, flags and
+    strings keep their last value. The rp_config measurement tells
+    dashboards which tier to read for a time range. Provisioning is
+    idempotent: policies are created or altered to the configured
+    durations, outdated rollup queries are replaced.
+    """
+
+    RAW_DURATION = os.getenv('DB_RP_RAW_DURATION', '7d')
+    ROLLUP_1M_DURATION = os.getenv('DB_RP_1M_DURATION', '90d')
+    ROLLUP_1H_DURATION = os.getenv('DB_RP_1H_DURATION', 'INF')
+
+    # dashboard time ranges served from each tier, up to [ms]
+    RAW_RANGE = 86400000
+    ROLLUP_1M_RANGE = 30 * 86400000
+    RANGE_INF = 2 ** 53
+
+    # seconds of the InfluxDB duration units
+    DURATION_UNITS = {'w': 604800, 'd': 86400, 'h': 3600, 'm': 60, 's': 1,
+                      'ms': 1e-3, 'u': 1e-6, '\u00b5': 1e-6, 'ns': 1e-9}
+
+    CQ_PREFIX = 'cq_'
+    CONFIG_POLICY = 'rollup_1h'     # kept forever
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, db, database):
+        """Initialize with an InfluxDBClient."""
+        self.db = db
+        self.database = database
+
+    @classmethod
+    def seconds(cls, duration):
+        """Seconds of a duration like 7d or 168h0m0s, None if infinite."""
+        if duration.upper() == 'INF':
+            return None
+        total = sum(int(number) * cls.DURATION_UNITS[unit] for number, unit in
+                    re.findall('(\\d+)(ns|ms|[wdhmsu\u00b5])', duration))
+        return total or None
+
+    def policies(self):
+        """(name, duration, default) of the tiers."""
+        return (('raw', self.RAW_DURATION, True),
+                ('rollup_1m', self.ROLLUP_1M_DURATION, False),
+                ('rollup_1h', self.ROLLUP_1H_DURATION, False))
+
+    @staticmethod
+    def aggregates() -> dict:
+        """Rolled up fields of each measurement with their aggregate function."""
+        status = []
+        for name, _, field_type in Voltronic.QPIGS_PARSER.schema:
+            if field_type in (float, int):
+                status.append((name, 'mean'))
+            else:
+                status.extend((flag, 'last') for flag in field_type.names)
+        energy = []
+        for name in EnergyCounter.SOURCES:
+            # counters: the last value is exact, a mean would lag behind
+            energy.extend(((name + '_kwh', 'last'), (name + '_kwh_today', 'last')))
+        return {
+            'operational_status': status,
+            'warning_status': [(flag, 'last') for flag in Voltronic.QPIWS_WARNING_BITS.names],
+            'device_mode': [('mode', 'last')],
+            'link_status': [('reachable', 'last')],
+            'energy': energy,
+        }
+
+    def continuous_queries(self) -> dict:
+        """Rollup queries by name, as (select, resample options)."""
+        queries = dict()
+        for target, source, interval, resample in (
+                ('rollup_1m', 'raw', '1m', 'EVERY 1m FOR 5m'),
+                ('rollup_1h', 'rollup_1m', '1h', 'EVERY 1h FOR 2h')):
+            for measurement, fields in self.aggregates().items():
+                select = 'SELECT {} INTO "{db}"."{}"."{m}" FROM "{db}"."{}"."{m}" ' \
+                         'GROUP BY time({}), *'.format(
+                             ', '.join('{}("{f}") AS "{f}"'.format(function, f=field)
+                                       for field, function in fields),
+                             target, source, interval, db=self.database, m=measurement)
+                digest = hashlib.sha1((select + resample).encode()).hexdigest()[:8]
+                name = '{}{}_{}_{}'.format(self.CQ_PREFIX, target, measurement, digest)
+                queries[name] = select, resample
+        return queries
+
+    def provision(self):
+        """Create or update policies, rollup queries and the tier config."""
+        self.db.create_database(self.database)
+        existing = {policy['name'] for policy in
+                    self.db.get_list_retention_policies(self.database)}
+        for name, duration, default in self.policies():
+            if name in existing:
+                self.db.alter_retention_policy(
+                    name, self.database, duration, 1, default or None)
+            else:
+                self.db.create_retention_policy(
+                    name, duration, 1, self.database, default)
+                self.log.info("InfluxDB - created retention policy %s (%s).", name, duration)
+        existing = set()
+        for database in self.db.get_list_continuous_queries():
+            for query in database.get(self.database, []):
+                existing.add(query['name'])
+        wanted = self.continuous_queries()
+        managed = tuple('{}{}_'.format(self.CQ_PREFIX, name) for name, _, _ in self.policies())
+        for name in existing - set(wanted):
+            if name.startswith(managed):
+                self.db.drop_continuous_query(name, self.database)
+                self.log.info("InfluxDB - dropped continuous query %s.", name)
+        for name in set(wanted) - existing:
+            select, resample = wanted[name]
+            self.db.create_continuous_query(name, select, self.database, resample)
+            self.log.info("InfluxDB - created continuous query %s.", name)
+        self._write_config()
+
+    def _write_config(self):
+        """Time range limits of the tiers, for the dashboard $rp variable."""
+        limits = ((0, self.RAW_RANGE, 'raw'),
+                  (self.RAW_RANGE, self.ROLLUP_1M_RANGE, 'rollup_1m'),
+                  (self.ROLLUP_1M_RANGE, self.RANGE_INF, 'rollup_1h'))
+        self.db.write_points(
+            [{'measurement': 'rp_config', 'time': 0, 'tags': {'tier': rp},
+              'fields': {'rp': rp, 'start': start, 'end': end}}
+             for start, end, rp in limits],
+            time_precision='ms', retention_policy=self.CONFIG_POLICY)
@@ -0,0 +1,83 @@
+"""Retry policy and circuit breaker module."""
+import os
+import random
+import time
+
+
+class RetryPolicy(object):
+    """Bounded retries with a deadline and exponential backoff with jitter."""
+
+    MAX_ATTEMPTS = int(os.getenv('CMD_MAX_ATTEMPTS', 3))
+    DEADLINE = float(os.getenv('CMD_DEADLINE', 15))
+    BACKOFF_MIN = float(os.getenv('CMD_BACKOFF_MIN', 0.2))
+    BACKOFF_MAX = float(os.getenv('CMD_BACKOFF_MAX', 5))
+
+    def __init__(self, max_attempts=None, deadline=None,
+                 backoff_min=None, backoff_max=None):
+        """Initialize policy, unset parameters come from the environment."""
+        self.max_attempts = max_attempts or self.MAX_ATTEMPTS
+        self.deadline = deadline or self.DEADLINE
+        self.backoff_min = backoff_min or self.BACKOFF_MIN
+        self.backoff_max = backoff_max or self.BACKOFF_MAX
+
+    def backoff(self, attempt) -> float:
+        """Delay before the given (1-based) retry, with equal jitter."""
+        delay = min(self.backoff_max, self.backoff_min * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    def delays(self, max_attempts=None):
+        """Generate the delay to wait before each attempt.
+
+        Stops when the attempts are used up or when the next backoff would
+        run past the deadline. Waiting is up to the caller, so the policy
+        serves blocking and asyncio code alike.
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(max_attempts or self.max_attempts):
+            delay = self.backoff(attempt) if attempt else 0
+            if time.monotonic() + delay >= deadline:
+                return
+            yield delay
+
+
+class CircuitBreaker(object):
+    """Fail fast while a link is down, probe it periodically."""
+
+    FAILURE_THRESHOLD = int(os.getenv('LINK_FAILURE_THRESHOLD', 3))
+    PROBE_INTERVAL = float(os.getenv('LINK_PROBE_INTERVAL', 30))
+
+    def __init__(self, failure_threshold=None, probe_interval=None):
+        """Initialize closed breaker."""
+        self.failure_threshold = failure_threshold or self.FAILURE_THRESHOLD
+        self.probe_interval = probe_interval or self.PROBE_INTERVAL
+        self.failures = 0
+        self._opened_at = None
+
+    @property
+    def is_open(self) -> bool:
+        """True while the link is considered down."""
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        """Tell whether a request may go out now.
+
+        While open, one probe request is allowed per probe interval.
+        """
+        if self._opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self._opened_at >= self.probe_interval:
+            self._opened_at = now
+            return True
+        return False
+
+    def success(self):
+        """Record a successful request, closes the breaker."""
+        self.failures = 0
+        self._opened_at = None
+
+    def failure(self):
+        """Record a failed request, opens the breaker over the threshold."""
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
@@ -0,0 +1,143 @@
+"""High resolution sample ring buffer module."""
+import bisect
+import csv
+import logging
+import math
+import threading
+from array import array
+
+from response_parser import BitField
+
+
+class Rollup(object):
+    """Incremental min, max and mean of fields over wall-clock aligned periods."""
+
+    def __init__(self, name, period, names, flags):
+        """Initialize an empty period, flags only get a mean."""
+        self.name = name
+        self.period = period
+        self.names = names
+        self.flags = flags
+        self.start = None
+        self._min = array('d', [math.inf] * len(names))
+        self._max = array('d', [-math.inf] * len(names))
+        self._sum = array('d', [0.0] * len(names))
+        self._count = 0
+
+    def add(self, timestamp, values):
+        """Add a sample, returns (start, fields) of a completed period or None."""
+        start = timestamp - timestamp % self.period
+        completed = None
+        if self.start is not None and start != self.start:
+            completed = self.flush()
+        self.start = start
+        minimum, maximum, total = self._min, self._max, self._sum
+        for position, value in enumerate(values):
+            if value < minimum[position]:
+                minimum[position] = value
+            if value > maximum[position]:
+                maximum[position] = value
+            total[position] += value
+        self._count += 1
+        return completed
+
+    def flush(self):
+        """(start, fields) of the current period and start a new one."""
+        if not self._count:
+            return None
+        fields = dict()
+        for position, name in enumerate(self.names):
+            fields[name + '_mean'] = self._sum[position] / self._count
+            if not self.flags[position]:
+                fields[name + '_min'] = self._min[position]
+                fields[name + '_max'] = self._max[position]
+        completed = self.start, fields
+        for position in range(len(self.names)):
+            self._min[position] = math.inf
+            self._max[position] = -math.inf
+            self._sum[position] = 0.0
+        self._count = 0
+        return completed
+
+
+class RingBuffer(object):
+    """Fixed size window of the latest samples with rollups.
+
+    Every field is kept in its own contiguous array (float, int or flag),
+    so memory is constant and no per-sample objects are held. Appending
+    a sample also feeds the rollups, completed periods are returned to
+    be shipped instead of the raw samples.
+    """
+
+    ROLLUPS = (('1m', 60), ('1h', 3600))
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, parser, capacity, rollups=ROLLUPS):
+        """Initialize the arrays for the fields of a ResponseParser."""
+        self.names = []
+        typecodes = []
+        for name, _, field_type in parser.schema:
+            if isinstance(field_type, BitField):
+                self.names.extend(field_type.names)
+                typecodes.extend('b' * len(field_type.names))
+            else:
+                self.names.append(name)
+                typecodes.append('d' if field_type is float else 'q')
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = [array(typecode, bytes(array(typecode).itemsize * capacity))
+                        for typecode in typecodes]
+        flags = [typecode == 'b' for typecode in typecodes]
+        self.rollups = [Rollup(name, period, self.names, flags)
+                        for name, period in rollups]
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of samples in the window."""
+        return self._count
+
+    def append(self, timestamp, sample):
+        """Store a sample, returns the completed rollups as (name, start, fields)."""
+        values = [sample[name] for name in self.names]
+        with self._lock:
+            position = self._next
+            self.times[position] = timestamp
+            for column, value in zip(self.columns, values):
+                column[position] = value
+            self._next = (position + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+        completed = []
+        for rollup in self.rollups:
+            result = rollup.add(timestamp, values)
+            if result is not None:
+                completed.append((rollup.name,) + result)
+        return completed
+
+    def _ordered(self, column):
+        if self._count < self.capacity:
+            return column[:self._count]
+        return column[self._next:] + column[:self._next]
+
+    def window(self, start=None, end=None) -> dict:
+        """Samples between start and end timestamps, as arrays by field."""
+        with self._lock:
+            times = self._ordered(self.times)
+            columns = [self._ordered(column) for column in self.columns]
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = len(times) if end is None else bisect.bisect_right(times, end)
+        window = {'time': times[first:last]}
+        for name, column in zip(self.names, columns):
+            window[name] = column[first:last]
+        return window
+
+    def dump(self, path):
+        """Write the window to a CSV file."""
+        window = self.window()
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(window.keys())
+            writer.writerows(zip(*window.values()))
+        self.log.info("Dumped %d samples to %s.", len(window['time']), path)
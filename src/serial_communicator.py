@@ -1,75 +1,166 @@
 """Serial communication handler module."""
+import binascii
 import os
 import struct
+import time
 import serial
 
-from PyCRC.CRCCCITT import CRCCCITT
-
 
 class SerCom(object):
     """Class for serial communication handling."""
 
     SERIAL_PORT_NAME =  os.getenv('SERIAL_PORT', '/dev/ttyUSB0')
+    REOPEN_DELAY_MIN = float(os.getenv('SERIAL_REOPEN_DELAY_MIN', 1))
+    REOPEN_DELAY_MAX = float(os.getenv('SERIAL_REOPEN_DELAY_MAX', 60))
+    FRAME_TIMEOUT = float(os.getenv('SERIAL_FRAME_TIMEOUT', 3))
     CR = b'\x0d'
+    # the inverter increments CRC bytes which would read as '(', CR or LF
+    CRC_ESCAPE = bytes(b + 1 if b in (0x28, 0x0d, 0x0a) else b for b in range(256))
 
-    def __init__(self):
-        """Initialize serial line."""
+    def __init__(self, port=None):
+        """Initialize and open serial line."""
         self._ser = serial.Serial()
-        self._ser.port = SerCom.SERIAL_PORT_NAME
+        self._ser.port = port or SerCom.SERIAL_PORT_NAME
         self._ser.baudrate = 2400
-        self._ser.timeout = 3
+        self._ser.timeout = SerCom.FRAME_TIMEOUT
+        self._rx_buffer = bytearray()
+        self._reopen_delay = 0
+        self._reopen_time = 0
+        # instrumentation timestamps [perf_counter s] of the last command
+        self.open_duration = None
+        self.sent_at = None
+        self.first_byte_at = None
+        self.frame_at = None
+        self.recorder = None    # FrameRecorder of every request/response
+        self._request = None
+        self.status = "CLOSED"
+        self.open()
+
+    def __enter__(self):
+        """Open serial connection on context entry."""
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Gracefully closes serial connection on exit."""
+        self.close()
+
+    def open(self) -> bool:
+        """Open serial line if not yet open.
+
+        Failed attempts are throttled with an exponential backoff, calls
+        during the backoff period return immediately.
+        """
+        if self._ser.is_open:
+            return True
+        now = time.monotonic()
+        if now < self._reopen_time:
+            return False
+        started = time.perf_counter()
         try:
             self._ser.open()
         except serial.SerialException:
-            # log serial error
+            self._reopen_delay = min(
+                max(self._reopen_delay * 2, SerCom.REOPEN_DELAY_MIN),
+                SerCom.REOPEN_DELAY_MAX)
+            self._reopen_time = now + self._reopen_delay
             self.status = "ERROR"
-            return
+            return False
+        self._reopen_delay = 0
+        self.open_duration = time.perf_counter() - started
         self.status = "OK"
-        # log(ser.name)
+        return True
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Gracefully closes serial connection on exit."""
+    def close(self):
+        """Close serial line."""
+        self._ser.close()
+        self.status = "CLOSED"
+
+    def _io_failure(self):
+        """Drop the connection after an I/O error, next open() reconnects."""
         self._ser.close()
+        self.status = "ERROR"
 
     @staticmethod
     def _get_crc(raw_data) -> bytes:
-        if raw_data == "POP02":
-            # workaround of axpert firmware bug
-            return struct.pack('>H', 0xE20B)
-        else:
-            return struct.pack('>H', CRCCCITT().calculate(raw_data))
+        """CRC-XMODEM of a bytes-like frame, escaped like the inverter does."""
+        return struct.pack('>H', binascii.crc_hqx(raw_data, 0)).translate(SerCom.CRC_ESCAPE)
 
     def _decode_response(self, data_with_crc: bytearray) -> str:
-        response_crc = bytes(data_with_crc[-2:])
-        response_data = bytes(data_with_crc[:-2])
-        if response_crc == SerCom._get_crc(response_data):
-            self.response_is_valid = True
-            self.response_status = "CRC_OK"
-        else:
-            self.response_is_valid = False
-            self.response_status = "CRC_ERROR"
-        return response_data.decode(encoding='ascii')
+        with memoryview(data_with_crc) as response:
+            if response[-2:] == SerCom._get_crc(response[:-2]):
+                self.response_is_valid = True
+                self.response_status = "CRC_OK"
+            else:
+                self.response_is_valid = False
+                self.response_status = "CRC_ERROR"
+            return str(response[:-2], encoding='ascii')
 
     def send_cmd(self, raw_cmd: str):
         """Send serial command with CRC."""
         self.status = "SENDING"
         cmd = bytearray(raw_cmd, encoding='ascii')
-        cmd.extend(SerCom._get_crc(raw_cmd))
+        self._request = bytes(cmd)
+        cmd.extend(SerCom._get_crc(cmd))
         cmd.extend(SerCom.CR)
-        self._ser.write(cmd)
+        try:
+            # drop late answers of previous, timed out commands
+            self._ser.reset_input_buffer()
+            self._rx_buffer.clear()
+            self.sent_at = self.first_byte_at = self.frame_at = None
+            self._ser.write(cmd)
+            self.sent_at = time.perf_counter()
+        except serial.SerialException:
+            self._io_failure()
+
+    def _read_frame(self):
+        """Read bytes up to the next CR within one frame deadline.
+
+        Whatever is waiting in the input buffer is fetched in one call,
+        bytes following the CR are kept for the next frame. The port
+        timeout is set once, a frame stalling halfway may take up to
+        twice FRAME_TIMEOUT.
+        """
+        deadline = time.monotonic() + SerCom.FRAME_TIMEOUT
+        if self._ser.timeout != SerCom.FRAME_TIMEOUT:
+            self._ser.timeout = SerCom.FRAME_TIMEOUT
+        searched = 0
+        while True:
+            frame_end = self._rx_buffer.find(SerCom.CR, searched)
+            if frame_end >= 0:
+                frame = self._rx_buffer[:frame_end]
+                del self._rx_buffer[:frame_end + 1]
+                return frame
+            searched = len(self._rx_buffer)
+            if time.monotonic() >= deadline:
+                return None
+            chunk = self._ser.read(self._ser.in_waiting or 1)
+            if len(chunk) == 0:
+                return None
+            if self.first_byte_at is None:
+                self.first_byte_at = time.perf_counter()
+            self._rx_buffer.extend(chunk)
 
     def read_resp(self) -> str:
         """Receive serial response with CRC check."""
+        if self.status != "SENDING":
+            return False
         self.status = "RECEIVING"
-        raw_response = bytearray()
-        while True:
-            response_byte = self._ser.read()
-            if len(response_byte) == 0:
-                self.status = "RESPONSE_TIMEOUT"
-                return False
-            if response_byte == SerCom.CR:
-                break
-            raw_response.extend(response_byte)
+        try:
+            raw_response = self._read_frame()
+        except serial.SerialException:
+            self._io_failure()
+            return False
+        return self._check_frame(raw_response)
+
+    def _check_frame(self, raw_response) -> str:
+        """Validate a received frame, response without the leading '('."""
+        if self.recorder is not None:
+            self.recorder.record(self._request, raw_response or b'')
+        if raw_response is None:
+            self.status = "RESPONSE_TIMEOUT"
+            return False
+        self.frame_at = time.perf_counter()
         response_str = self._decode_response(raw_response)
         if self.response_is_valid:
             self.status = "OK"
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""Serial gateway, sharing one inverter port with local clients.
+
+The gateway owns the serial port and serves PI30 commands over a Unix
+socket, one request per line: '<priority> <command>', answered by
+'OK <response>' or the serial status of a failed attempt, e.g.
+'CRC_ERROR'. Voltronic uses the gateway when its port is given as
+'unix:<socket path>'.
+
+    python serial_gateway.py serve
+    python serial_gateway.py query QID
+"""
+import argparse
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from frame_recorder import FrameRecorder
+from serial_communicator import SerCom
+
+
+PRIORITIES = {'setpoint': 0, 'interactive': 1, 'poll': 2}
+
+
+def is_query(cmd) -> bool:
+    """Queries do not change the device and can be shared."""
+    return cmd.startswith('Q')
+
+
+class SerialGateway(object):
+    """Serialize the commands of many clients onto one port.
+
+    Commands run one at a time by priority: setpoints first, then
+    interactive queries, then polling. A query asked for while the same
+    query is queued or running is not sent again, all askers get the one
+    response. Every request is a single attempt, retries are left to
+    the clients.
+    """
+
+    SOCKET_PATH = os.getenv('GATEWAY_SOCKET', 'var/solar/gateway.sock')
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, port=None, path=None, name='gateway'):
+        """Initialize the serial session and the request queue."""
+        self.path = path or self.SOCKET_PATH
+        self._ser = SerCom(port)
+        if FrameRecorder.ENABLED:
+            self._ser.recorder = FrameRecorder(name)
+        self._queue = []        # heap of (priority, sequence, cmd, future)
+        self._sequence = itertools.count()
+        self._pending = dict()  # query -> future, while queued or running
+        self._lock = threading.Condition()
+        self._closing = False
+        self._server = None
+        self.exchanges = 0
+        self.coalesced = 0
+        self._worker = threading.Thread(target=self._run, name='gateway', daemon=True)
+        self._worker.start()
+
+    def submit(self, cmd, priority='poll') -> concurrent.futures.Future:
+        """Queue a command, the future resolves to (status, response)."""
+        level = 0 if not is_query(cmd) else PRIORITIES[priority]
+        with self._lock:
+            future = self._pending.get(cmd) if is_query(cmd) else None
+            if future is not None:
+                self.coalesced += 1
+                if future.running():
+                    return future
+            else:
+                future = concurrent.futures.Future()
+                if is_query(cmd):
+                    self._pending[cmd] = future
+            # a queued query asked with a higher priority is queued again,
+            # the lower entry is skipped once the future is done
+            heapq.heappush(self._queue, (level, next(self._sequence), cmd, future))
+            self._lock.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._closing:
+                    self._lock.wait()
+                if self._closing:
+                    break
+                _, _, cmd, future = heapq.heappop(self._queue)
+                if future.done() or not future.set_running_or_notify_cancel():
+                    continue
+            try:
+                result = self._exchange(cmd)
+            except Exception:
+                # e.g. a noisy non-ASCII frame or a full frame log disk
+                self.log.exception("Serial gateway - %s failed.", cmd)
+                result = 'ERROR', None
+            with self._lock:
+                if self._pending.get(cmd) is future:
+                    del self._pending[cmd]
+            future.set_result(result)
+        self._ser.close()
+        if self._ser.recorder is not None:
+            self._ser.recorder.close()
+
+    def _exchange(self, cmd):
+        """One serial attempt, returns (status, response)."""
+        self.exchanges += 1
+        if not self._ser.open():
+            return self._ser.status, None
+        self._ser.send_cmd(cmd)
+        response = self._ser.read_resp()
+        if response:
+            return 'OK', response
+        return self._ser.status, None
+
+    def serve_forever(self):
+        """Serve clients on the Unix socket until closed."""
+        gateway = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        priority, cmd = line.decode('ascii').split()
+                        status, response = gateway.submit(cmd, priority).result(
+                            GatewayClient.TIMEOUT)
+                    except (ValueError, KeyError):
+                        status, response = 'ERROR', None
+                    except concurrent.futures.TimeoutError:
+                        status, response = 'RESPONSE_TIMEOUT', None
+                    reply = status if response is None else '{} {}'.format(status, response)
+                    self.wfile.write(reply.encode('ascii') + b'\n')
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self._server.daemon_threads = True
+        self.log.info("Serial gateway listening on %s.", self.path)
+        self._server.serve_forever()
+
+    def close(self):
+        """Stop serving and release the port."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            os.unlink(self.path)
+        with self._lock:
+            self._closing = True
+            self._lock.notify()
+        self._worker.join()
+
+
+class GatewayClient(object):
+    """Serial transport talking to a SerialGateway, interchangeable with SerCom."""
+
+    URL_PREFIX = 'unix:'
+    PRIORITY = os.getenv('GATEWAY_PRIORITY', 'poll')
+    TIMEOUT = float(os.getenv('GATEWAY_TIMEOUT', 30))   # queueing and exchange
+
+    def __init__(self, url, priority=None):
+        """Initialize and connect to the gateway socket of url."""
+        self.path = url[len(self.URL_PREFIX):] if url.startswith(self.URL_PREFIX) else url
+        self.priority = priority or self.PRIORITY
+        self._sock = None
+        self._reader = None
+        self._reopen_delay = 0
+        self._reopen_time = 0
+        self.open_duration = None
+        self.sent_at = None
+        self.first_byte_at = None
+        self.frame_at = None
+        self.recorder = None    # frames are recorded by the gateway
+        self.status = "CLOSED"
+        self.open()
+
+    def open(self) -> bool:
+        """Connect to the gateway if not yet connected.
+
+        Failed attempts are throttled like SerCom.open(), calls during the
+        backoff period return immediately.
+        """
+        if self._sock is not None:
+            return True
+        now = time.monotonic()
+        if now < self._reopen_time:
+            return False
+        started = time.perf_counter()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.TIMEOUT)
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            self._reopen_delay = min(
+                max(self._reopen_delay * 2, SerCom.REOPEN_DELAY_MIN),
+                SerCom.REOPEN_DELAY_MAX)
+            self._reopen_time = now + self._reopen_delay
+            self.status = "ERROR"
+            return False
+        self._sock = sock
+        self._reader = sock.makefile('rb')
+        self._reopen_delay = 0
+        self.open_duration = time.perf_counter() - started
+        self.status = "OK"
+        return True
+
+    def close(self):
+        """Disconnect from the gateway."""
+        if self._reader is not None:
+            self._reader.close()
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._reader = None
+        self.status = "CLOSED"
+
+    def _io_failure(self):
+        self.close()
+        self.status = "ERROR"
+
+    def send_cmd(self, raw_cmd: str):
+        """Send a command to the gateway."""
+        self.status = "SENDING"
+        self.sent_at = self.first_byte_at = self.frame_at = None
+        if self._sock is None:
+            self.status = "ERROR"
+            return
+        try:
+            self._sock.sendall('{} {}\n'.format(self.priority, raw_cmd).encode('ascii'))
+        except OSError:
+            self._io_failure()
+            return
+        self.sent_at = time.perf_counter()
+
+    def read_resp(self) -> str:
+        """Receive the response, status carries the failure of the gateway attempt."""
+        if self.status != "SENDING":
+            return False
+        self.status = "RECEIVING"
+        try:
+            line = self._reader.readline()
+        except OSError:
+            line = b''
+        if not line:
+            self._io_failure()
+            return False
+        self.frame_at = time.perf_counter()
+        status, _, response = line.decode('ascii').rstrip('\n').partition(' ')
+        self.status = status
+        return response if status == 'OK' else False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--socket', default=SerialGateway.SOCKET_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='own the serial port and serve clients')
+    serve.add_argument('--port', help='serial port, default: SERIAL_PORT')
+    serve.add_argument('--name', default='gateway', help='inverter name of recorded frames')
+    query = commands.add_parser('query', help='send one command through the gateway')
+    query.add_argument('cmd')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'serve':
+        gateway = SerialGateway(args.port, args.socket, args.name)
+        try:
+            gateway.serve_forever()
+        except KeyboardInterrupt:
+            gateway.close()
+    else:
+        client = GatewayClient(args.socket, 'interactive')
+        if client.open():
+            client.send_cmd(args.cmd)
+            response = client.read_resp()
+            print(response if response is not False else client.status)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
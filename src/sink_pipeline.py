@@ -0,0 +1,384 @@
+"""Sink pipeline module."""
+import collections
+import csv
+import gzip
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from emission_filter import EmissionFilter
+from point_spool import PointSpool
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:     # MQTT sink is optional
+    mqtt = None
+
+
+Record = collections.namedtuple('Record', 'measurement time tags fields')
+Record.__doc__ = """One sample: measurement name, time in ms, tags and fields."""
+
+
+class Sink(object):
+    """Base of the sinks, each with its own bounded queue and writer thread.
+
+    When the queue is full, put() applies the back-pressure policy of the
+    sink: drop_oldest discards the oldest record, block waits up to
+    SINK_BLOCK_TIMEOUT for room before dropping, spill moves the older
+    half of the queue to an on-disk spool, replayed a batch every
+    SINK_REPLAY_INTERVAL between the live writes.
+    Records failing to write are spooled with the spill policy and
+    dropped otherwise. Subclasses implement write(records).
+    """
+
+    POLICIES = ('drop_oldest', 'block', 'spill')
+    POLICY = os.getenv('SINK_POLICY', 'drop_oldest')
+    QUEUE_SIZE = int(os.getenv('SINK_QUEUE_SIZE', 10000))
+    BATCH_SIZE = int(os.getenv('SINK_BATCH_SIZE', 500))
+    BLOCK_TIMEOUT = float(os.getenv('SINK_BLOCK_TIMEOUT', 1))
+    RETRY_INTERVAL = float(os.getenv('SINK_RETRY_INTERVAL', 10))
+    REPLAY_INTERVAL = float(os.getenv('SINK_REPLAY_INTERVAL', 2))
+    SPOOL_DIR = os.getenv('SINK_SPOOL_DIR', 'var/solar')
+    SPOOL_MAX_POINTS = int(os.getenv('SINK_SPOOL_MAX_POINTS', 1000000))
+
+    name = 'sink'
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, policy=None, queue_size=None):
+        """Initialize the queue and start the writer thread.
+
+        The policy defaults to SINK_<NAME>_POLICY, then SINK_POLICY.
+        """
+        self.policy = policy or os.getenv(
+            'SINK_{}_POLICY'.format(self.name.upper()), self.POLICY)
+        if self.policy not in self.POLICIES:
+            raise ValueError('Unknown sink policy: {}'.format(self.policy))
+        self.queue_size = queue_size or self.QUEUE_SIZE
+        self.dropped_records = 0
+        self._queue = collections.deque()
+        self._lock = threading.Condition()
+        self._closing = False
+        self._down = False
+        self._spool = None
+        self._next_replay = 0
+        if self.policy == 'spill':
+            self._spool = PointSpool(
+                os.path.join(self.SPOOL_DIR, 'sink-{}.sqlite'.format(self.name)),
+                self.SPOOL_MAX_POINTS)
+        self._worker = threading.Thread(
+            target=self._write_loop, name='sink-' + self.name, daemon=True)
+        self._worker.start()
+
+    def write(self, records):
+        """Deliver a batch of records, raising an exception on failure."""
+        raise NotImplementedError
+
+    def close_backend(self):
+        """Release the backend after the last write."""
+
+    def put(self, record):
+        """Queue a record, applying the back-pressure policy when full."""
+        with self._lock:
+            if len(self._queue) >= self.queue_size:
+                if self.policy == 'block':
+                    self._lock.wait_for(
+                        lambda: len(self._queue) < self.queue_size or self._closing,
+                        self.BLOCK_TIMEOUT)
+                if self.policy == 'spill':
+                    self._spool.put([self._queue.popleft()._asdict()
+                                     for _ in range(max(1, len(self._queue) // 2))])
+                elif len(self._queue) >= self.queue_size:
+                    self._queue.popleft()
+                    self.dropped_records += 1
+            self._queue.append(record)
+            self._lock.notify_all()
+
+    def close(self, timeout=10):
+        """Write queued records and stop the writer thread."""
+        with self._lock:
+            self._closing = True
+            self._lock.notify_all()
+        self._worker.join(timeout)
+
+    def _next_batch(self):
+        with self._lock:
+            if not self._queue and not self._closing:
+                self._lock.wait(self._replay_delay())
+            batch = [self._queue.popleft()
+                     for _ in range(min(len(self._queue), self.BATCH_SIZE))]
+            self._lock.notify_all()
+            return batch
+
+    def _replay_delay(self):
+        """Seconds until the next replay batch is due, None if nothing to do."""
+        if self._spool is None or len(self._spool) == 0:
+            return None
+        return max(self._next_replay - time.monotonic(), 0)
+
+    def _deliver(self, records) -> bool:
+        try:
+            self.write(records)
+        except Exception as err:
+            if not self._down:
+                self.log.warning("Sink [%s] - write failed: %s", self.name, err)
+            self._down = True
+            return False
+        if self._down:
+            self.log.info("Sink [%s] - writes restored.", self.name)
+        self._down = False
+        return True
+
+    def _write_failed(self, batch):
+        if self._spool is not None:
+            self._spool.put([record._asdict() for record in batch])
+        else:
+            with self._lock:
+                self.dropped_records += len(batch)
+        with self._lock:
+            if not self._closing:
+                self._lock.wait_for(lambda: self._closing, self.RETRY_INTERVAL)
+
+    def _replay(self):
+        """Write one batch of spooled records, oldest first."""
+        if self._replay_delay() != 0:
+            return
+        ids, points = self._spool.peek(self.BATCH_SIZE)
+        if self._deliver([Record(**point) for point in points]):
+            self._spool.remove(ids)
+            self._next_replay = time.monotonic() + self.REPLAY_INTERVAL
+        else:
+            self._next_replay = time.monotonic() + self.RETRY_INTERVAL
+
+    def _write_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                if (self._closing and self._down) or not self._deliver(batch):
+                    self._write_failed(batch)
+                    continue
+            elif self._closing:
+                break
+            if not self._closing:
+                self._replay()
+            with self._lock:
+                dropped, self.dropped_records = self.dropped_records, 0
+            if dropped:
+                self.log.warning("Sink [%s] - %d records were dropped.", self.name, dropped)
+        if self._spool is not None:
+            self._spool.close()
+        self.close_backend()
+
+
+class StdoutSink(Sink):
+    """Print records as JSON lines."""
+
+    name = 'stdout'
+
+    def write(self, records):
+        sys.stdout.write(''.join(json.dumps(record._asdict()) + '\n' for record in records))
+        sys.stdout.flush()
+
+
+class CsvSink(Sink):
+    """Append records to one CSV file per measurement.
+
+    The columns are fixed by the header of the file, fields appearing
+    later are not written.
+    """
+
+    CSV_DIR = os.getenv('CSV_DIR', 'var/solar/csv')
+
+    name = 'csv'
+
+    def __init__(self, policy=None, queue_size=None):
+        """Initialize the file handles."""
+        os.makedirs(self.CSV_DIR, exist_ok=True)
+        self._files = dict()        # measurement -> file, writer
+        super().__init__(policy, queue_size)
+
+    def _writer(self, record):
+        if record.measurement not in self._files:
+            path = os.path.join(self.CSV_DIR, record.measurement + '.csv')
+            header = None
+            if os.path.exists(path) and os.path.getsize(path):
+                with open(path, newline='') as csv_file:
+                    header = next(csv.reader(csv_file))
+            csv_file = open(path, 'a', newline='')
+            writer = csv.DictWriter(
+                csv_file, header or ['time'] + sorted(record.tags) + list(record.fields),
+                extrasaction='ignore')
+            if header is None:
+                writer.writeheader()
+            self._files[record.measurement] = csv_file, writer
+        return self._files[record.measurement][1]
+
+    def write(self, records):
+        for record in records:
+            self._writer(record).writerow(
+                dict(record.fields, time=record.time, **record.tags))
+        for csv_file, _ in self._files.values():
+            csv_file.flush()
+
+    def close_backend(self):
+        for csv_file, _ in self._files.values():
+            csv_file.close()
+
+
+def _escape(text, special=', ='):
+    text = str(text).replace('\\', '\\\\')
+    for char in special:
+        text = text.replace(char, '\\' + char)
+    return text
+
+
+def _field_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return '{}i'.format(value)
+    if isinstance(value, float):
+        return repr(value)
+    return '"{}"'.format(_escape(value, '"'))
+
+
+def series_key(measurement, tags) -> str:
+    """Escaped measurement and sorted tags, the line protocol series."""
+    series = _escape(measurement, ', ')
+    for key in sorted(tags or ()):
+        series += ',{}={}'.format(_escape(key), _escape(tags[key]))
+    return series
+
+
+def line_protocol(record) -> str:
+    """InfluxDB line protocol of a record, time in ms."""
+    fields = ','.join('{}={}'.format(_escape(key), _field_value(value))
+                      for key, value in record.fields.items())
+    return '{} {} {}'.format(series_key(record.measurement, record.tags), fields, record.time)
+
+
+class LineProtocolSink(Sink):
+    """Write records to the InfluxDB 2.x HTTP API in line protocol."""
+
+    URL = os.getenv('INFLUX2_URL', 'http://localhost:8086')
+    ORG = os.getenv('INFLUX2_ORG', 'solar')
+    BUCKET = os.getenv('INFLUX2_BUCKET', 'solar')
+    TOKEN = os.getenv('INFLUX2_TOKEN', '')
+    TIMEOUT = float(os.getenv('INFLUX2_TIMEOUT', 10))
+
+    name = 'influxdb2'
+
+    def write(self, records):
+        body = gzip.compress(
+            '\n'.join(line_protocol(record) for record in records).encode('utf-8'))
+        request = urllib.request.Request(
+            '{}/api/v2/write?{}'.format(self.URL.rstrip('/'), urllib.parse.urlencode(
+                {'org': self.ORG, 'bucket': self.BUCKET, 'precision': 'ms'})),
+            data=body, method='POST',
+            headers={'Authorization': 'Token ' + self.TOKEN,
+                     'Content-Type': 'text/plain; charset=utf-8',
+                     'Content-Encoding': 'gzip'})
+        with urllib.request.urlopen(request, timeout=self.TIMEOUT):
+            pass
+
+
+class MqttSink(Sink):
+    """Publish the fields of each record as JSON to <topic>/<inverter>/<measurement>."""
+
+    MQTT_HOST = os.getenv('MQTT_HOST', 'localhost')
+    MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
+    MQTT_TOPIC = os.getenv('MQTT_TOPIC', 'solar')
+    MQTT_QOS = int(os.getenv('MQTT_QOS', 0))
+    MQTT_USER = os.getenv('MQTT_USER')
+    MQTT_PASS = os.getenv('MQTT_PASS')
+
+    name = 'mqtt'
+
+    def __init__(self, policy=None, queue_size=None):
+        """Connect to the broker in the background."""
+        if mqtt is None:
+            raise ImportError('The mqtt sink needs the paho-mqtt package.')
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        else:
+            self._client = mqtt.Client()
+        if self.MQTT_USER:
+            self._client.username_pw_set(self.MQTT_USER, self.MQTT_PASS)
+        self._client.connect_async(self.MQTT_HOST, self.MQTT_PORT)
+        self._client.loop_start()
+        super().__init__(policy, queue_size)
+
+    def write(self, records):
+        for record in records:
+            topic = '/'.join(filter(None, (
+                self.MQTT_TOPIC, record.tags.get('inverter'), record.measurement)))
+            info = self._client.publish(
+                topic, json.dumps(dict(record.fields, time=record.time)), self.MQTT_QOS)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                raise ConnectionError(mqtt.error_string(info.rc))
+
+    def close_backend(self):
+        self._client.disconnect()
+        self._client.loop_stop()
+
+
+class SinkPipeline(object):
+    """Fan out the samples of the inverters to the sinks as records.
+
+    Unchanged values are filtered once for all sinks, each sink queues
+    and writes on its own, so a slow one holds up neither the others nor
+    the serial polling.
+    """
+
+    SINKS = os.getenv('SINKS', 'influxdb')     # comma separated sink names
+    SINK_TYPES = {
+        'stdout': StdoutSink,
+        'csv': CsvSink,
+        'influxdb2': LineProtocolSink,
+        'mqtt': MqttSink,
+    }
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, sinks):
+        """Initialize with sinks having put(record) and close()."""
+        self.sinks = list(sinks)
+        self.emission_filter = EmissionFilter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Pipeline of the sinks listed in SINKS."""
+        # imported here, influxdbhandler itself depends on this module
+        from influxdbhandler import InfluxDBHandler
+        sink_types = dict(cls.SINK_TYPES, influxdb=InfluxDBHandler)
+        sinks = []
+        for name in filter(None, (name.strip() for name in cls.SINKS.split(','))):
+            if name not in sink_types:
+                raise ValueError('Unknown sink: {}'.format(name))
+            cls.log.info("Starting sink [%s].", name)
+            sinks.append(sink_types[name]())
+        return cls(sinks)
+
+    def write_measurements(self, data, measurement, tags=None, timestamp=None):
+        """Queue changed inverter statistics to every sink."""
+        if timestamp is None:
+            timestamp = time.time_ns() // 1000000
+        series = tuple(sorted(tags.items())) if tags else None
+        with self._lock:
+            fields = self.emission_filter.filter(measurement, data, series)
+        if not fields:
+            return
+        record = Record(measurement, timestamp, dict(tags or {}), fields)
+        for sink in self.sinks:
+            sink.put(record)
+
+    def close(self):
+        """Flush and stop every sink."""
+        for sink in self.sinks:
+            sink.close()
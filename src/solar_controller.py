@@ -2,36 +2,27 @@
 """Solar inverter controller."""
 import logging
 import os
-import sched
 import signal
 import sys
-import time
 
-import influxdbhandler
-import inverter_configurator
-import voltronic_protocol
-
-def info_loop():
-    log.debug('---> INFO loop started --->')
-    proto.get_warning_status()
-    db.write_measurements(proto.warning, 'warning_status')
-    proto.get_device_mode()
-    db.write_measurements({'mode': proto.device_mode.name}, 'device_mode')
-    proto.get_operational_status()
-    db.write_measurements(proto.status, 'operational_status')
-    scheduler.enter(5,3,info_loop)
-    log.debug('<--- INFO loop finished.')
-
-def setup_loop():
-    log.debug('---> SETUP loop started --->')
-    icfg._check_inverter_configuration()
-    scheduler.enter(30,1,setup_loop)
-    log.debug('<--- SETUP loop finished.')
+import inverter_worker
+import metrics_exporter
+import sink_pipeline
 
 def signal_handler(sig, frame):
-    log.info('SIGINT received, exiting.')
+    log.info('%s received, exiting.', signal.Signals(sig).name)
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join(10)
+    db.close()
+    metrics.close()
     sys.exit(0)
 
+def dump_signal_handler(sig, frame):
+    for worker in workers:
+        worker.dump_ring()
+
 ### main program
 # logger startup
 log = logging.getLogger()
@@ -43,13 +34,27 @@ log.addHandler(log_handler)
 log.info('STARTING Solar Inverter Controller...')
 
 # initializing main modules
-proto = voltronic_protocol.Voltronic()
-icfg = inverter_configurator.InverterConfig(proto)
-db = influxdbhandler.InfluxDBHandler()
+db = sink_pipeline.SinkPipeline.from_env()
+metrics = metrics_exporter.MetricsExporter()
+workers = [
+    inverter_worker.InverterWorker(
+        inverter['name'],
+        inverter.get('port'),
+        inverter.get('config'),
+        db,
+        metrics if metrics.port else None)
+    for inverter in inverter_worker.InverterWorker.load_inverters()
+]
 
-# main loop
+# main loop, one worker thread per inverter
 signal.signal(signal.SIGINT, signal_handler)
-scheduler = sched.scheduler()
-setup_loop()
-info_loop()
-scheduler.run()
+signal.signal(signal.SIGTERM, signal_handler)
+signal.signal(signal.SIGUSR1, dump_signal_handler)
+for worker in workers:
+    log.info('Starting inverter [%s].', worker.name)
+    worker.start()
+while any(worker.is_alive() for worker in workers):
+    for worker in workers:
+        worker.join(1)
+db.close()
+metrics.close()
@@ -1,10 +1,32 @@
 """Voltronic protocol handler module."""
 import logging
 import os
+import re
 import time
 from enum import Enum
+from functools import partial
 
 import serial_communicator
+from instrumentation import Instrumentation
+from response_parser import BitField, ResponseParser
+from retry_policy import CircuitBreaker, RetryPolicy
+from serial_gateway import GatewayClient
+
+
+class VoltronicError(Exception):
+    """Base class of Voltronic protocol errors."""
+
+
+class CommunicationError(VoltronicError):
+    """No valid response arrived from the inverter."""
+
+
+class LinkDownError(CommunicationError):
+    """Command not sent, the serial link is known to be down."""
+
+
+class CommandRejectedError(VoltronicError):
+    """The inverter refused the command with NAK."""
 
 
 class Voltronic(object):
@@ -12,30 +34,151 @@ class Voltronic(object):
 
     log = logging.getLogger(__name__)
 
-    @staticmethod
-    def _send_cmd(cmd):
-        ser = serial_communicator.SerCom()
+    transport = serial_communicator.SerCom
+
+    # seconds a device state query stays valid, unless invalidated by a write
+    CACHE_TTL = {
+        'QPIRI': float(os.getenv('CACHE_TTL_QPIRI', 600)),
+        'QFLAG': float(os.getenv('CACHE_TTL_QFLAG', 600)),
+    }
+
+    # cached queries made stale by each setter command
+    CACHE_INVALIDATION = {
+        'POP': ('QPIRI',),
+        'PBT': ('QPIRI',),
+        'PCVV': ('QPIRI',),
+        'PBFT': ('QPIRI',),
+        'PBDV': ('QPIRI',),
+        'PBCV': ('QPIRI',),
+        'PSDV': ('QPIRI',),
+        'PCP': ('QPIRI',),
+        'PGR': ('QPIRI',),
+        'MCHGC': ('QPIRI',),
+        'MUCHGC': ('QPIRI',),
+        'PE': ('QFLAG',),
+        'PD': ('QFLAG',),
+        'PF': ('QPIRI', 'QFLAG'),
+    }
+
+    def _query(self, cmd, handler=None):
+        """Send command and pass the response to handler.
+
+        All commands go through here, AsyncVoltronic overrides it with a
+        coroutine so the get_*/set_* methods become awaitable. Queries with
+        a fresh cached result are not sent at all.
+        """
+        if self._cache_hit(cmd):
+            return None
+        started = time.perf_counter()
+        response = self._handle(cmd, handler, self._send_cmd(cmd), started)
+        # a response failing to parse leaves the state stale, not cached
+        self._cache_store(cmd)
+        return response
+
+    def _handle(self, cmd, handler, response, started):
+        """Pass the response to handler, recording parse and total time."""
+        if handler:
+            parse_started = time.perf_counter()
+            response = handler(response)
+            finished = time.perf_counter()
+            self.instrumentation.observe(cmd, 'parse', finished - parse_started)
+        else:
+            finished = time.perf_counter()
+        self.instrumentation.observe(cmd, 'total', finished - started)
+        return response
+
+    def _cache_hit(self, cmd) -> bool:
+        """True if cmd is a still valid cached query.
+
+        Otherwise the cached queries cmd is going to change are invalidated.
+        """
+        if self._cache_expiry.get(cmd, 0) > time.monotonic():
+            Voltronic.log.debug('%s: cached', cmd)
+            self.instrumentation.count(cmd, 'cached')
+            return True
+        # command name without its arguments, e.g. PBCV50.0 -> PBCV
+        stale = Voltronic.CACHE_INVALIDATION.get(re.match('[A-Z]*', cmd).group())
+        if stale:
+            self.invalidate_cache(*stale)
+        return False
+
+    def _cache_store(self, cmd):
+        ttl = Voltronic.CACHE_TTL.get(cmd)
+        if ttl:
+            self._cache_expiry[cmd] = time.monotonic() + ttl
+
+    def invalidate_cache(self, *cmds):
+        """Force the given cached queries (all if none given) to be re-sent."""
+        if cmds:
+            for cmd in cmds:
+                self._cache_expiry.pop(cmd, None)
+        else:
+            self._cache_expiry.clear()
+
+    def _send_cmd(self, cmd):
+        ser = self._ser
         response = None
-        while True:
-            if ser.status in ["OK", "CRC_ERROR", "RESPONSE_TIMEOUT"]:
-                Voltronic.log.debug('-> %s ...', cmd)
-                ser.send_cmd(cmd)
-                response = ser.read_resp()
-                if response:
-                    if response == 'NAK':
-                        Voltronic.log.debug(
-                            '%s, serial communication failure: got NAK, repeating...', cmd)
-                    else:
-                        break
-            else:
-                time.sleep(1)
-            Voltronic.log.debug(
-                '%s, serial communication failure: timeout, status: %s, retrying...',
-                cmd,
-                ser.status)
+        for attempt, delay in enumerate(self._retry.delays(self._max_attempts(cmd))):
+            if attempt:
+                self._log_retry(cmd, response)
+                time.sleep(delay)
+            if not ser.open():
+                response = None
+                self._record_attempt(cmd, attempt, response, None)
+                continue
+            Voltronic.log.debug('-> %s ...', cmd)
+            started = time.perf_counter()
+            ser.send_cmd(cmd)
+            response = ser.read_resp()
+            self._record_attempt(cmd, attempt, response, started)
+            if response and response != 'NAK':
+                return self._succeeded(cmd, response)
+        self._failed(cmd, response)
+
+    def _max_attempts(self, cmd):
+        """Attempts allowed for a command, raises while the link is down."""
+        if not self._breaker.allow():
+            raise LinkDownError('{}: serial link is down'.format(cmd))
+        # a single attempt is enough to probe a link that is down
+        return 1 if self._breaker.is_open else None
+
+    def _record_attempt(self, cmd, attempt, response, started):
+        """Feed the stage timings and outcome of an attempt to instrumentation."""
+        ser = self._ser
+        if attempt:
+            self.instrumentation.count(cmd, 'retries')
+        timings = {'open': ser.open_duration}
+        if started is not None and ser.sent_at is not None:
+            timings['write'] = ser.sent_at - started
+            if ser.first_byte_at is not None:
+                timings['first_byte'] = ser.first_byte_at - ser.sent_at
+            if ser.frame_at is not None:
+                timings['frame'] = ser.frame_at - ser.sent_at
+        ser.open_duration = None
+        self.instrumentation.attempt(cmd, response, ser.status, timings)
+
+    def _log_retry(self, cmd, response):
+        Voltronic.log.debug(
+            '%s, serial communication failure: %s, retrying...',
+            cmd,
+            'NAK' if response == 'NAK' else self._ser.status)
+
+    def _succeeded(self, cmd, response):
+        self._breaker.success()
         Voltronic.log.debug('%s <- %s', cmd, response)
         return response
 
+    def _failed(self, cmd, response):
+        self.instrumentation.count(cmd, 'failed')
+        if response == 'NAK':
+            # the inverter answered, only the command was refused
+            self._breaker.success()
+            raise CommandRejectedError('{}: rejected by inverter (NAK)'.format(cmd))
+        self._breaker.failure()
+        if self._breaker.is_open:
+            Voltronic.log.warning('%s: serial link is down, status: %s', cmd, self._ser.status)
+        raise CommunicationError('{}: no valid response, status: {}'.format(cmd, self._ser.status))
+
     class DeviceMode(Enum):
         """Enum definition for DeviceMode."""
 
@@ -74,8 +217,128 @@ class Voltronic(object):
         SolarAndUtility = 2
         OnlySolar = 3
 
-    def __init__(self):
-        """Constructor."""
+    DEVICE_MODES = {
+        'P': DeviceMode.PowerOn,
+        'S': DeviceMode.StandBy,
+        'L': DeviceMode.Line,
+        'B': DeviceMode.Battery,
+        'F': DeviceMode.Fault,
+        'H': DeviceMode.PowerSave
+    }
+
+    QPIRI_PARSER = ResponseParser((
+        ('grid_voltage', 0, float),
+        ('grid_current', 1, float),
+        ('ac_output_voltage', 2, float),
+        ('ac_output_frequency', 3, float),
+        ('ac_output_current', 4, float),
+        ('ac_output_apparent_power', 5, int),
+        ('ac_output_active_power', 6, int),
+        ('battery_nominal_voltage', 7, float),
+        ('battery_recharge_voltage', 8, float),
+        ('battery_under_voltage', 9, float),
+        ('battery_bulk_voltage', 10, float),
+        ('battery_float_voltage', 11, float),
+        ('battery_type', 12, BatteryType),
+        ('max_ac_charging_current', 13, int),
+        ('max_charging_current', 14, int),
+        ('output_quality', 15, OutputQuality),
+        ('output_source_priority', 16, InverterSource),
+        ('charger_source_priority', 17, ChargerSource),
+        ('parallel_max_num', 18, int),
+        ('machine_type', 19, int),
+        ('topology', 20, int),
+        ('output_mode', 21, int),
+        ('battery_redischarge_voltage', 22, float),
+        ('pv_ok_condition', 23, int),
+        ('pv_power_balance', 24, int),
+    ))
+
+    QPIGS_PARSER = ResponseParser((
+        ('grid_voltage', 0, float),
+        ('grid_frequency', 1, float),
+        ('ac_output_voltage', 2, float),
+        ('ac_output_frequency', 3, float),
+        ('ac_output_apparent_power', 4, int),
+        ('ac_output_active_power', 5, int),
+        ('output_load_percent', 6, int),
+        ('bus_voltage', 7, int),
+        ('battery_voltage', 8, float),
+        ('battery_charging_current', 9, int),
+        ('battery_capacity', 10, int),
+        ('heat_sink_temperature', 11, int),
+        ('pv_input_current', 12, int),
+        ('pv_input_voltage', 13, float),
+        ('scc_battery_voltage', 14, float),
+        ('battery_discharge_current', 15, int),
+        (None, 16, BitField((
+            ('ac_charging_status', 0x01),
+            ('solar_charging_status', 0x02),
+            ('charging_status', 0x04),
+            ('constant_voltage_charging_phase', 0x08),
+            ('load_status', 0x10),
+            ('scc_firmware_updated', 0x20),
+            ('configuration_changed', 0x40),
+            ('sbu_priority_version', 0x80),
+        ))),
+    ))
+
+    QPIWS_WARNING_BITS = BitField((
+        ('battery_too_low_to_charge', 0x04),
+        ('mppt_overload_warning', 0x08),
+        ('mppt_overload_fault', 0x10),
+        ('pv_voltage_high', 0x20),
+        ('power_limit', 0x40),
+        ('overload', 0x8000),
+        ('battery_under_shutdown', 0x20000),
+        ('battery_low', 0x800000),
+        ('battery_high', 0x1000000),
+        ('fan_locked', 0x2000000),
+        ('overtemperature', 0x4000000),
+        ('opv_short', 0x20000000),
+        ('line_fail', 0x40000000),
+    ))
+
+    QPIWS_FAULT_BITS = BitField((
+        ('battery_short', 0x80),
+        ('current_sensor_fail', 0x100),
+        ('battery_open', 0x200),
+        ('op_dc_overvoltage', 0x400),
+        ('self_test_fail', 0x800),
+        ('inverter_soft_fail', 0x1000),
+        ('inverter_overcurrent', 0x2000),
+        ('eeprom_fault', 0x4000),
+        ('inverter_voltage_too_high', 0x8000000),
+        ('inverter_voltage_too_low', 0x10000000),
+        ('bus_soft_fail', 0x80000000),
+        ('bus_undervoltage', 0x100000000),
+        ('bus_overvoltage', 0x200000000),
+        ('inverter_fault', 0x400000000),
+    ))
+
+    # QFLAG option letters, listed after 'D' when disabled
+    QFLAG_OPTIONS = (
+        ('buzzer', 'a'),
+        ('overload_bypass', 'b'),
+        ('power_saving', 'j'),
+        ('lcd_escape_timeout', 'k'),
+        ('overload_restart', 'u'),
+        ('overtemperature_restart', 'v'),
+        ('lcd_backlight', 'x'),
+        ('primary_source_interrupt_alarm', 'y'),
+        ('fault_code_record', 'z'),
+    )
+
+    def __init__(self, port=None):
+        """Constructor, a 'unix:<path>' port connects through a serial gateway."""
+        if port and port.startswith(GatewayClient.URL_PREFIX):
+            self._ser = GatewayClient(port)
+        else:
+            self._ser = self.transport(port)
+        self._retry = RetryPolicy()
+        self._breaker = CircuitBreaker()
+        self._cache_expiry = dict()
+        self.instrumentation = Instrumentation()
         self.protocol_id = None
         self.serial_number = None
         self.firmware_version = None
@@ -93,247 +356,169 @@ class Voltronic(object):
         # self.get_firmware_version()
         # self.get_firmware2_version()
 
+    def close(self):
+        """Close the serial session."""
+        self._ser.close()
+
+    def record_frames(self, recorder):
+        """Record the raw frames of every command with a FrameRecorder."""
+        self._ser.recorder = recorder
+
     def get_protocol_version(self):
         """Protocol ID. PI30 for HS series."""
-        self.protocol_id = self._send_cmd('QPI')
+        return self._query('QPI', partial(setattr, self, 'protocol_id'))
 
     def get_device_serial(self):
         """Device serial number."""
-        self.serial_number = self._send_cmd('QID')
+        return self._query('QID', partial(setattr, self, 'serial_number'))
 
     def get_firmware_version(self):
         """Main CPU FW version."""
-        self.firmware_version = self._send_cmd('QVFW')
+        return self._query('QVFW', partial(setattr, self, 'firmware_version'))
 
     def get_firmware2_version(self):
         """Another CPU (Solar Charge Controller) FW version."""
-        self.firmware2_version = self._send_cmd('QVFW2')
+        return self._query('QVFW2', partial(setattr, self, 'firmware2_version'))
 
     def get_device_rating(self):
         """Device Rating Information inquiry."""
-        response = self._send_cmd('QPIRI').split()
-        self.rating['grid_voltage'] = float(response[0])
-        self.rating['grid_current'] = float(response[1])
-        self.rating['ac_output_voltage'] = float(response[2])
-        self.rating['ac_output_frequency'] = float(response[3])
-        self.rating['ac_output_current'] = float(response[4])
-        self.rating['ac_output_apparent_power'] = int(response[5])
-        self.rating['ac_output_active_power'] = int(response[6])
-        self.rating['battery_nominal_voltage'] = float(response[7])
-        self.rating['battery_recharge_voltage'] = float(response[8])
-        self.rating['battery_under_voltage'] = float(response[9])
-        self.rating['battery_bulk_voltage'] = float(response[10])
-        self.rating['battery_float_voltage'] = float(response[11])
-        self.rating['battery_type'] = {
-            '0': Voltronic.BatteryType.AGM,
-            '1': Voltronic.BatteryType.Flooded,
-            '2': Voltronic.BatteryType.User
-        }[response[12]]
-        self.rating['max_ac_charging_current'] = int(response[13])
-        self.rating['max_charging_current'] = int(response[14])
-        self.rating['output_quality'] = {
-            '0': Voltronic.OutputQuality.Appliance,
-            '1': Voltronic.OutputQuality.UPS
-        }[response[15]]
-        self.rating['output_source_priority'] = {
-            '0': Voltronic.InverterSource.UtilityFirst,
-            '1': Voltronic.InverterSource.SolarFirst,
-            '2': Voltronic.InverterSource.SolarBatteryUtility
-        }[response[16]]
-        self.rating['charger_source_priority'] = {
-            '0': Voltronic.ChargerSource.UtilityFirst,
-            '1': Voltronic.ChargerSource.SolarFirst,
-            '2': Voltronic.ChargerSource.SolarAndUtility,
-            '3': Voltronic.ChargerSource.OnlySolar
-        }[response[17]]
-        self.rating['parallel_max_num'] = int(response[18])
-        self.rating['machine_type'] = int(response[19])
-        self.rating['topology'] = int(response[20])
-        self.rating['output_mode'] = int(response[21])
-        self.rating['battery_redischarge_voltage'] = float(response[22])
-        self.rating['pv_ok_condition'] = int(response[23])
-        self.rating['pv_power_balance'] = int(response[24])
+        return self._query('QPIRI', self._on_device_rating)
+
+    def _on_device_rating(self, response):
+        Voltronic.QPIRI_PARSER(response, self.rating)
         self.log.debug("Current rating: %s", self.rating)
 
     def get_options(self):
         """Device options statuses (enable/disable)."""
-        response = self._send_cmd('QFLAG').split('D')
-        self.flag['buzzer'] = 'a' not in response[1]
-        self.flag['overload_bypass'] = 'b' not in response[1]
-        self.flag['power_saving'] = 'j' not in response[1]
-        self.flag['lcd_escape_timeout'] = 'k' not in response[1]
-        self.flag['overload_restart'] = 'u' not in response[1]
-        self.flag['overtemperature_restart'] = 'v' not in response[1]
-        self.flag['lcd_backlight'] = 'x' not in response[1]
-        self.flag['primary_source_interrupt_alarm'] = 'y' not in response[1]
-        self.flag['fault_code_record'] = 'z' not in response[1]
+        return self._query('QFLAG', self._on_options)
+
+    def _on_options(self, response):
+        disabled = response.split('D')[1]
+        for name, letter in Voltronic.QFLAG_OPTIONS:
+            self.flag[name] = letter not in disabled
         self.log.debug("Current device options: %s", self.flag)
 
     def get_operational_status(self):
         """Device general status parameters inquiry."""
-        response = self._send_cmd('QPIGS').split()
-        self.status['grid_voltage'] = float(response[0])
-        self.status['grid_frequency'] = float(response[1])
-        self.status['ac_output_voltage'] = float(response[2])
-        self.status['ac_output_frequency'] = float(response[3])
-        self.status['ac_output_apparent_power'] = int(response[4])
-        self.status['ac_output_active_power'] = int(response[5])
-        self.status['output_load_percent'] = int(response[6])
-        self.status['bus_voltage'] = int(response[7])
-        self.status['battery_voltage'] = float(response[8])
-        self.status['battery_charging_current'] = int(response[9])
-        self.status['battery_capacity'] = int(response[10])
-        self.status['heat_sink_temperature'] = int(response[11])
-        self.status['pv_input_current'] = int(response[12])
-        self.status['pv_input_voltage'] = float(response[13])
-        self.status['scc_battery_voltage'] = float(response[14])
-        self.status['battery_discharge_current'] = int(response[15])
-        device_status_bits = int(response[16], 2)
-        self.status['ac_charging_status'] = bool(device_status_bits & 0x01)
-        self.status['solar_charging_status'] = bool(device_status_bits & 0x02)
-        self.status['charging_status'] = bool(device_status_bits & 0x04)
-        self.status['constant_voltage_charging_phase'] = \
-            bool(device_status_bits & 0x08)
-        self.status['load_status'] = bool(device_status_bits & 0x10)
-        self.status['scc_firmware_updated'] = bool(device_status_bits & 0x20)
-        self.status['configuration_changed'] = bool(device_status_bits & 0x40)
-        self.status['sbu_priority_version'] = bool(device_status_bits & 0x80)
+        return self._query('QPIGS', self._on_operational_status)
+
+    def _on_operational_status(self, response):
+        was_changed = self.status.get('configuration_changed')
+        Voltronic.QPIGS_PARSER(response, self.status)
+        if self.status['configuration_changed'] and not was_changed:
+            # settings were changed e.g. on the front panel, the bit stays
+            # set for a while, invalidate only when it gets set
+            self.invalidate_cache()
         self.log.debug("Current status: %s", self.status)
 
     def get_device_mode(self):
         """Device Mode inquiry."""
-        response = self._send_cmd('QMOD')
-        self.device_mode = {
-            'P': Voltronic.DeviceMode.PowerOn,
-            'S': Voltronic.DeviceMode.StandBy,
-            'L': Voltronic.DeviceMode.Line,
-            'B': Voltronic.DeviceMode.Battery,
-            'F': Voltronic.DeviceMode.Fault,
-            'H': Voltronic.DeviceMode.PowerSave
-        }[response]
+        return self._query('QMOD', self._on_device_mode)
+
+    def _on_device_mode(self, response):
+        self.device_mode = Voltronic.DEVICE_MODES[response]
         self.log.debug("Current device mode: %s", self.device_mode)
 
     def get_warning_status(self):
         """Device Warning Status inquiry."""
-        device_warning_bits = int(self._send_cmd('QPIWS'), 2)
-        self.warning['battery_too_low_to_charge'] = \
-            bool(device_warning_bits & 0x04)
-        self.warning['mppt_overload_warning'] = \
-            bool(device_warning_bits & 0x08)
-        self.warning['mppt_overload_fault'] = bool(device_warning_bits & 0x10)
-        self.warning['pv_voltage_high'] = bool(device_warning_bits & 0x20)
-        self.warning['power_limit'] = bool(device_warning_bits & 0x40)
-        self.fault['battery_short'] = bool(device_warning_bits & 0x80)
-        self.fault['current_sensor_fail'] = bool(device_warning_bits & 0x100)
-        self.fault['battery_open'] = bool(device_warning_bits & 0x200)
-        self.fault['op_dc_overvoltage'] = bool(device_warning_bits & 0x400)
-        self.fault['self_test_fail'] = bool(device_warning_bits & 0x800)
-        self.fault['inverter_soft_fail'] = bool(device_warning_bits & 0x1000)
-        self.fault['inverter_overcurrent'] = bool(device_warning_bits & 0x2000)
-        self.fault['eeprom_fault'] = bool(device_warning_bits & 0x4000)
-        self.warning['overload'] = bool(device_warning_bits & 0x8000)
-        self.warning['battery_under_shutdown'] = \
-            bool(device_warning_bits & 0x20000)
-        self.warning['battery_low'] = bool(device_warning_bits & 0x800000)
-        self.warning['battery_high'] = bool(device_warning_bits & 0x1000000)
-        self.warning['fan_locked'] = bool(device_warning_bits & 0x2000000)
-        self.warning['overtemperature'] = bool(device_warning_bits & 0x4000000)
-        self.fault['inverter_voltage_too_high'] = \
-            bool(device_warning_bits & 0x8000000)
-        self.fault['inverter_voltage_too_low'] = \
-            bool(device_warning_bits & 0x10000000)
-        self.warning['opv_short'] = bool(device_warning_bits & 0x20000000)
-        self.warning['line_fail'] = bool(device_warning_bits & 0x40000000)
-        self.fault['bus_soft_fail'] = bool(device_warning_bits & 0x80000000)
-        self.fault['bus_undervoltage'] = \
-            bool(device_warning_bits & 0x100000000)
-        self.fault['bus_overvoltage'] = bool(device_warning_bits & 0x200000000)
-        self.fault['inverter_fault'] = bool(device_warning_bits & 0x400000000)
+        return self._query('QPIWS', self._on_warning_status)
+
+    def _on_warning_status(self, response):
+        device_warning_bits = int(response, 2)
+        Voltronic.QPIWS_WARNING_BITS.decode(device_warning_bits, self.warning)
+        Voltronic.QPIWS_FAULT_BITS.decode(device_warning_bits, self.fault)
         self.log.debug("Current warnings: %s %s", self.warning, self.fault)
 
     def get_defaults(self):
         """The default setting value information."""
-        defaults = self._send_cmd('QDI').split()
+        return self._query('QDI', self._on_defaults)
+
+    def _on_defaults(self, response):
+        defaults = response.split()
         self.default['ac_output_voltage'] = float(defaults[0])
         self.default['ac_output_frequency'] = float(defaults[1])
 
     def get_charging_current_values(self):
         """Enquiry selectable value about max charging current."""
-        self._send_cmd('QMCHGCR')
+        return self._query('QMCHGCR')
 
     def get_utility_charging_current_values(self):
         """Enquiry selectable value about max utility charging current."""
-        self._send_cmd('QMUCHGCR')
+        return self._query('QMUCHGCR')
 
     def get_dsp_has_bootstrap(self):
         """Enquiry DSP has bootstrap or not."""
-        self._send_cmd('QBOOT')
+        return self._query('QBOOT')
 
     def get_parallel_output_mode(self):
         """Enquiry output mode (for 4K/5K)."""
-        self._send_cmd('QOPM')
+        return self._query('QOPM')
 
     def get_parallel_operational_status(self, unit_number):
         """Parallel Information inquiry (for 4K/5K)."""
-        self._send_cmd('QPGS' + str(unit_number))
+        return self._query('QPGS' + str(unit_number))
 
     def set_inverter_source(self, inverter_source: InverterSource):
         """POP <NN> <cr>: Setting device output source priority."""
-        self._send_cmd('POP' + str(inverter_source.value).zfill(2))
+        return self._query('POP' + str(inverter_source.value).zfill(2))
 
     def set_battery_type(self, battery_type: BatteryType):
         """PBT <NN> <cr>: Setting battery type."""
-        self._send_cmd('PBT' + str(battery_type.value).zfill(2))
+        return self._query('PBT' + str(battery_type.value).zfill(2))
     def set_battery_bulk_voltage(self, bulk_voltage: float):
         """PCVV <nn.n> <cr>: Set battery bulk charge C.V. voltage."""
-        self._send_cmd('PCVV' + '{:04.1f}'.format(bulk_voltage))
+        return self._query('PCVV' + '{:04.1f}'.format(bulk_voltage))
     def set_battery_float_voltage(self, float_voltage: float):
         """PBFT <nn.n> <cr>: Set battery float charge C.C. voltage."""
-        self._send_cmd('PBFT' + '{:04.1f}'.format(float_voltage))
+        return self._query('PBFT' + '{:04.1f}'.format(float_voltage))
     def set_battery_redischarge_voltage(self, redischarge_voltage: float):
         """PBDV <nn.n> <cr>: Set battery redischarge voltage."""
-        self._send_cmd('PBDV' + '{:04.1f}'.format(redischarge_voltage))
+        return self._query('PBDV' + '{:04.1f}'.format(redischarge_voltage))
     def set_battery_recharge_voltage(self, recharge_voltage: float):
         """PBCV <nn.n> <cr>: Set battery recharge voltage."""
-        self._send_cmd('PBCV' + '{:04.1f}'.format(recharge_voltage))
+        return self._query('PBCV' + '{:04.1f}'.format(recharge_voltage))
     def set_battery_cutoff_voltage(self, cutoff_voltage: float):
         """PSDV <nn.n> <cr>: Set battery cutoff voltage."""
-        self._send_cmd('PSDV' + '{:04.1f}'.format(cutoff_voltage))
+        return self._query('PSDV' + '{:04.1f}'.format(cutoff_voltage))
 
     def set_charger_source(self, charger_source: ChargerSource):
         """PCP <NN> <cr>: Setting device charger priority."""
-        self._send_cmd('PCP' + str(charger_source.value).zfill(2))
+        return self._query('PCP' + str(charger_source.value).zfill(2))
 
     def set_output_quality(self, output_quality: OutputQuality):
         """PGR <NN> <cr>: Setting device grid working range."""
-        self._send_cmd('PGR' + str(output_quality.value).zfill(2))
+        return self._query('PGR' + str(output_quality.value).zfill(2))
 
     def set_max_charging_current(self, max_current: int):
         """MCHGC <mnn> <cr>: Setting max charging current."""
-        self._send_cmd('MCHGC' + str(max_current).zfill(3))
+        return self._query('MCHGC' + str(max_current).zfill(3))
 
     def set_max_utility_charging_current(self, max_current: int):
         """MUCHGC <mnn> <cr>: Setting utility max charging current."""
-        self._send_cmd('MUCHGC' + str(max_current).zfill(3))
+        return self._query('MUCHGC' + str(max_current).zfill(3))
 
     def _set_flag_option(self, flag, enable):
         """PE <XXX> / PD <XXX> <CRC> <cr>: setting some status enable/disable"""
         if enable:
-            self._send_cmd('PE' + flag)
+            return self._query('PE' + flag)
         else:
-            self._send_cmd('PD' + flag)
+            return self._query('PD' + flag)
 
-    def set_flag_b(self, flag, enable):
-        self._set_flag_option('b', enable)
+    def set_flag_b(self, enable):
+        """PEb / PDb: Enable/disable overload bypass."""
+        return self._set_flag_option('b', enable)
 
-    def set_flag_u(self, flag, enable):
-        self._set_flag_option('u', enable)
+    def set_flag_u(self, enable):
+        """PEu / PDu: Enable/disable overload restart."""
+        return self._set_flag_option('u', enable)
 
-    def set_flag_v(self, flag, enable):
-        self._set_flag_option('v', enable)
+    def set_flag_v(self, enable):
+        """PEv / PDv: Enable/disable overtemperature restart."""
+        return self._set_flag_option('v', enable)
 
-    def set_flag_y(self, flag, enable):
-        self._set_flag_option('y', enable)
+    def set_flag_y(self, enable):
+        """PEy / PDy: Enable/disable primary source interrupt alarm."""
+        return self._set_flag_option('y', enable)
 
     # PF < cr >: Setting control parameter to default value
     # F < nn > < cr >: Setting device output rating frequency